@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import json
 import os
 
 from pathlib import Path
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "chat_with_document",
 ]
 
@@ -51,6 +53,8 @@ LOGOUT_REDIRECT_URL = '/'  # Redirect users to login page after logout
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # Serves static files before the rest of the stack runs (see STORAGES below)
+    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -88,10 +92,37 @@ DATABASES = {
         'PASSWORD': '1238',   # Replace with your PostgreSQL password
         'HOST': 'localhost',           # Set to your database host, e.g., '127.0.0.1'
         'PORT': '5432',                # Default PostgreSQL port
+        # Keep connections open between requests instead of reconnecting every time.
+        # Set DB_CONN_MAX_AGE=0 to restore per-request connections.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Cache
+# Local-memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared backend
+# (file, Redis, Memcached) when running more than one worker process.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'smart-document-chat'),
+        'TIMEOUT': 300,
+    }
+}
+# Whether every worker process sees the same entries (and so the same invalidations)
+CACHE_IS_SHARED = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Per-user document list / latest chat session cache used by the index page
+DOCUMENT_LIST_CACHE_TIMEOUT = int(os.getenv('DOCUMENT_LIST_CACHE_TIMEOUT', '900'))
+
+# Sessions are read from the cache and only fall back to the database on a miss
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
 AUTH_USER_MODEL = 'chat_with_document.CustomUser'
 
 
@@ -144,6 +175,22 @@ STATIC_URL = '/static/'  # URL prefix for static files
 STATIC_ROOT = BASE_DIR / 'staticfiles'  # Directory to collect static files
 STATICFILES_DIRS = [BASE_DIR / 'static']  # Where your app-specific static files are stored
 
+# Outside DEBUG, `collectstatic` writes content-hashed copies of every asset (css/index.3f2a1c.css)
+# plus gzip and brotli versions, and {% static %} links to the hashed names. WhiteNoiseMiddleware
+# serves the precompressed file the browser accepts and marks hashed files immutable with a far-future
+# max-age, so repeat page loads never re-download unchanged assets. DEBUG keeps plain names and no collectstatic.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": (
+            "django.contrib.staticfiles.storage.StaticFilesStorage" if DEBUG
+            else "whitenoise.storage.CompressedManifestStaticFilesStorage"
+        ),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -152,15 +199,170 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Resumable chunked uploads (see chat_with_document/uploads.py)
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.getenv('CHUNKED_UPLOAD_CHUNK_SIZE', str(2 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', str(500 * 1024 * 1024)))
+CHUNKED_UPLOAD_EXPIRY = int(os.getenv('CHUNKED_UPLOAD_EXPIRY', str(24 * 3600)))  # Idle seconds before a partial upload is deleted
+CHUNKED_UPLOAD_RESUME_AFTER = 900  # A finalized upload still processing after this long is re-ingested on the next finalize
+
+# Per-user resource accounting (see chat_with_document/accounting.py). Usage is buffered in memory and
+# rolled up into UsageRollup rows every USAGE_FLUSH_INTERVAL seconds, not written per request.
+USAGE_FLUSH_INTERVAL = int(os.getenv('USAGE_FLUSH_INTERVAL', '60'))
+# Optional quotas, 0 disables. Upload quotas are checked before an upload is accepted,
+# the daily token quota before each question that needs the LLM. Days are UTC.
+QUOTA_VECTOR_BYTES = int(os.getenv('QUOTA_VECTOR_BYTES', '0'))  # Vector storage across the user's documents
+# Ingestion CPU is measured per thread, a lower bound that leaves out the embedding model's own threads
+QUOTA_DAILY_INGEST_CPU_SECONDS = float(os.getenv('QUOTA_DAILY_INGEST_CPU_SECONDS', '0'))
+QUOTA_DAILY_LLM_TOKENS = int(os.getenv('QUOTA_DAILY_LLM_TOKENS', '0'))  # Prompt + completion tokens
+QUOTA_CACHE_TIMEOUT = 30  # Rolled-up totals used by quota checks are cached this long
+
+# Chat history full-text search (see chat_with_document/search.py)
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))
+
+# Bulk uploads of many PDFs or ZIP archives (see chat_with_document/bulk.py)
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', '500'))  # PDFs per batch, ZIP contents included
+BULK_UPLOAD_MAX_SIZE = int(os.getenv('BULK_UPLOAD_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))  # Uncompressed bytes per batch
+BULK_INGEST_WORKERS = int(os.getenv('BULK_INGEST_WORKERS', '4'))  # PDFs parsed and split in parallel
+BULK_EMBED_BATCH_SIZE = int(os.getenv('BULK_EMBED_BATCH_SIZE', '256'))  # Chunks per embedding call, across documents
+BULK_STALE_SECONDS = int(os.getenv('BULK_STALE_SECONDS', '300'))  # Time without a heartbeat from its process after which a processing batch is re-queued
+DATA_UPLOAD_MAX_NUMBER_FILES = BULK_UPLOAD_MAX_FILES
+
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# Embedding model for new documents. Existing documents keep the model they were embedded with
+# until `manage.py migrate_embeddings` moves them (e.g. to "sentence-transformers/all-mpnet-base-v2").
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L12-v2")
+
+# Chunking strategies (see chat_with_document/chunking.py). Chosen per document at upload.
+# chunk_size=None with the "tokens" splitter uses the embedding model's max sequence length.
+CHUNKING_STRATEGIES = {
+    "recursive": {"splitter": "characters", "chunk_size": 1000, "chunk_overlap": 200},
+    "token": {"splitter": "tokens", "chunk_size": None, "chunk_overlap": 0.1},
+}
+DEFAULT_CHUNKING_STRATEGY = os.getenv("DEFAULT_CHUNKING_STRATEGY", "recursive")
+
+# Admission control for LLM calls (see chat_with_document/admission.py). Limits are per worker process.
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))  # Requests waiting beyond this get a "busy" response
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))  # Seconds a request may wait for a slot
+LLM_USER_RATE = float(os.getenv("LLM_USER_RATE", "0.5"))  # Sustained questions per second per user
+LLM_USER_BURST = int(os.getenv("LLM_USER_BURST", "5"))
+
+# LLM deadlines, retries, hedging and fallback (see chat_with_document/llm.py)
+LLM_PRIMARY_MODEL = os.getenv("LLM_PRIMARY_MODEL", "llama-3.3-70b-versatile")
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama-3.1-8b-instant")  # Empty to disable fallback
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # Deadline of a single LLM request, in seconds
+LLM_SLO_SECONDS = float(os.getenv("LLM_SLO_SECONDS", "15"))  # Budget for the primary model before falling back
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = 0.5  # Base of the jittered exponential backoff, in seconds
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))  # Used until enough latencies are recorded for a p95
+
+# Optional cross-encoder rerank stage between retrieval and the LLM (see chat_with_document/rerank.py)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = 20  # Chunks fetched from the vector store
+RERANK_TOP_N = 5  # Most chunks passed to the LLM
+RERANK_MIN_DOCS = 2  # Always kept, whatever their score
+RERANK_SCORE_THRESHOLD = float(os.getenv("RERANK_SCORE_THRESHOLD", "0.0"))
+RERANK_BATCH_SIZE = 16
+
+# Document summaries built in the background at ingestion (see chat_with_document/summaries.py)
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")
+SUMMARY_MAP_CHARS = int(os.getenv("SUMMARY_MAP_CHARS", "12000"))  # Text per map/reduce LLM call
+SUMMARY_QUESTION_COUNT = 5
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+
+
+# Chroma connection (see chat_with_document/vectordb.py)
+#   "embedded": single node, collections persisted under CHROMA_DB_PATH
+#   "server":   a shared Chroma server (`chroma run --path ... --port 8000`), so web and ingestion
+#               workers can run on separate nodes and scale independently. Those nodes must also share
+#               MEDIA_ROOT, where uploaded PDFs and their extracted-text cache live.
+CHROMA_MODE = os.getenv("CHROMA_MODE", "embedded")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", str(BASE_DIR / "chat_with_pdf"))
+CHROMA_SERVER = {
+    "host": os.getenv("CHROMA_HOST", "localhost"),
+    "port": int(os.getenv("CHROMA_PORT", "8000")),
+    "ssl": os.getenv("CHROMA_SSL", "false").lower() in ("1", "true", "yes"),
+    "token": os.getenv("CHROMA_TOKEN", ""),  # Sent as a bearer token when the server requires auth
+}
+
+# HNSW index parameters for Chroma collections. They are fixed when a collection is created, so they
+# are picked from the document's chunk count at ingestion: the first tier whose max_chunks covers it
+# (None: no limit). CHROMA_HNSW_OVERRIDES is applied on top, e.g. {"hnsw:search_ef": 150}.
+# Measure candidates on a real collection with `manage.py sweep_hnsw <collection_name>`.
+CHROMA_HNSW_TIERS = [
+    (2000, {"hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 50}),
+    (20000, {"hnsw:M": 32, "hnsw:construction_ef": 200, "hnsw:search_ef": 100}),
+    (None, {"hnsw:M": 48, "hnsw:construction_ef": 400, "hnsw:search_ef": 200}),
+]
+CHROMA_HNSW_OVERRIDES = json.loads(os.getenv("CHROMA_HNSW_OVERRIDES", "{}"))
+
+# Vector store backend: "chroma", or "mmap" for node-local memory-mapped float16/int8 arrays
+# (see chat_with_document/mmap_store.py; convert existing collections with `manage.py convert_to_mmap_store`).
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+MMAP_VECTOR_STORE = {
+    "path": os.getenv("MMAP_VECTOR_STORE_PATH", str(BASE_DIR / "mmap_vectors")),
+    "dtype": os.getenv("MMAP_VECTOR_STORE_DTYPE", "int8"),  # "float16" or "int8"
+    "rescore": True,  # Keep a float32 copy to re-score the top candidates
+    "rescore_candidates": 50,
+}
 
-CHROMA_DB_PATH = "chromadb_storage"
+# Logging
+# Configured once here. Records go through a QueueHandler so request threads never
+# block on I/O; a background QueueListener writes them to stderr and, if LOG_FILE is set,
+# appends them to that file. Rotate LOG_FILE with logrotate (no copytruncate needed):
+# every worker process writes to it, so no process may rotate it itself.
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_RETRIEVAL_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_RETRIEVAL_DEBUG_SAMPLE_RATE", "0.01"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "sampled_debug": {
+            "()": "chat_with_document.logging_utils.SampledDebugFilter",
+            "rate": LOG_RETRIEVAL_DEBUG_SAMPLE_RATE,
+        },
+    },
+    "handlers": {
+        "queued": {
+            "()": "chat_with_document.logging_utils.queued_handler",
+            "filename": LOG_FILE,
+            "fmt": "[%(asctime)s] %(lineno)d %(name)s - %(levelname)s - %(message)s",
+        },
+    },
+    "root": {
+        "handlers": ["queued"],
+        "level": os.getenv("LOG_LEVEL", "INFO"),
+    },
+    "loggers": {
+        # High-volume per-query retrieval logs; DEBUG records are sampled.
+        "chat_with_document.retrieval": {
+            "level": os.getenv("LOG_RETRIEVAL_LEVEL", "INFO"),
+            "filters": ["sampled_debug"],
+        },
+        # Django's own console handler would write to stderr from the request thread; propagate to "queued" only
+        "django": {
+            "handlers": [],
+            "level": "INFO",
+        },
+        # The Chroma HTTP client logs every request at INFO in server mode
+        "httpx": {
+            "level": "WARNING",
+        },
+    },
+}
 
+# A single backend: logins are one query by email, and the user of each authenticated
+# request is served from the cache (AUTH_USER_CACHE_TIMEOUT) instead of the database.
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',  # Keep the default backend
-    'chat_with_document.backends.EmailBackend',  # Add your custom backend
+    'chat_with_document.backends.EmailBackend',
 ]
+# Only with a shared cache: a process-local entry would outlive a password change or deactivation
+# saved by another process, which can only invalidate its own cache. 0 disables the user cache.
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', '900' if CACHE_IS_SHARED else '0'))
@@ -0,0 +1,228 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, time as dt_time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from . import metrics
+from .admission import AdmissionRejected
+from .models import CustomUser, UploadDocument, UsageRollup
+from .utils import collection_stats
+
+logger = logging.getLogger(__name__)
+
+
+# Per-user resource accounting. Requests only add to an in-memory buffer keyed by
+# (user, document, day); a background thread adds the buffered amounts to the UsageRollup
+# rows every USAGE_FLUSH_INTERVAL seconds, so the cost is one upsert per active
+# user/document per interval instead of a write per request.
+# Storage (chunk count and vector bytes) is a current size, kept on UploadDocument instead.
+_buffer = defaultdict(Counter)
+_buffer_lock = threading.Lock()
+_flusher = None
+
+
+class QuotaExceeded(AdmissionRejected):
+    """Raised when a user is over a quota; `retry_after` is None when waiting does not help."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__("quota_exceeded", retry_after)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def record(user_id, document_id, **amounts):
+    """
+    Adds usage (ingest_cpu_seconds, chunks_embedded, llm_calls, prompt_tokens, completion_tokens) to the buffer.
+    """
+    if user_id is None:
+        return
+    key = (user_id, document_id, timezone.now().date())
+    with _buffer_lock:
+        _buffer[key].update(amounts)
+    _start_flusher()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _buffer_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, name="usage-flush", daemon=True)
+            _flusher.start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.USAGE_FLUSH_INTERVAL)
+        close_old_connections()
+        flush()
+
+
+def _add_to_rollup(user_id, document_id, day, amounts):
+    rows = UsageRollup.objects.filter(user_id=user_id, document_id=document_id, day=day)
+    increments = {field: F(field) + value for field, value in amounts.items()}
+    if rows.update(**increments, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            UsageRollup.objects.create(user_id=user_id, document_id=document_id, day=day, **amounts)
+    except IntegrityError:
+        # Another process created the row in the meantime
+        rows.update(**increments, updated_at=timezone.now())
+
+
+def flush():
+    """
+    Writes the buffered usage to the rollup table. Amounts that fail to write stay buffered.
+    """
+    with _buffer_lock:
+        pending = dict(_buffer)
+        _buffer.clear()
+    for (user_id, document_id, day), amounts in pending.items():
+        try:
+            _add_to_rollup(user_id, document_id, day, amounts)
+        except Exception as e:
+            logger.error(f"Error writing usage rollup for user {user_id}: {e}", exc_info=True)
+            with _buffer_lock:
+                _buffer[(user_id, document_id, day)].update(amounts)
+    if pending:
+        metrics.increment("accounting.rollups_written", len(pending))
+
+
+atexit.register(flush)
+
+
+def record_ingestion(document, cpu_seconds, chunks_embedded=None):
+    """
+    Records an ingestion's usage and, if it completed, refreshes the document's storage
+    (chunk_count, vector_bytes). `chunks_embedded` defaults to the whole collection. The caller saves the document.
+
+    `cpu_seconds` is the thread CPU time of the threads that ingested the document, a lower bound: intra-op
+    threads of the embedding model (torch, BLAS) are not counted. Process CPU time would count them, but
+    also every other request served by the process meanwhile.
+    """
+    if document.status == "completed":
+        try:
+            document.chunk_count, document.vector_bytes = collection_stats(
+                document.collection_name, document.embedding_model_name
+            )
+        except Exception as e:
+            logger.warning(f"Could not measure the collection of document {document.id}: {e}")
+    if chunks_embedded is None:
+        chunks_embedded = document.chunk_count if document.status == "completed" else 0
+    record(document.user_id, document.id, ingest_cpu_seconds=cpu_seconds, chunks_embedded=chunks_embedded)
+
+
+def usage_today(user_id):
+    """
+    The user's usage today: rolled-up totals (cached for QUOTA_CACHE_TIMEOUT) plus this process's buffer.
+    """
+    day = timezone.now().date()
+    key = f"user:{user_id}:usage:{day}"
+    totals = cache.get(key)
+    if totals is None:
+        totals = UsageRollup.objects.filter(user_id=user_id, day=day).aggregate(
+            ingest_cpu_seconds=Sum("ingest_cpu_seconds"),
+            llm_tokens=Sum(F("prompt_tokens") + F("completion_tokens")),
+        )
+        totals = {name: value or 0 for name, value in totals.items()}
+        cache.set(key, totals, settings.QUOTA_CACHE_TIMEOUT)
+
+    with _buffer_lock:
+        for (buffered_user_id, _, buffered_day), amounts in _buffer.items():
+            if buffered_user_id == user_id and buffered_day == day:
+                totals["ingest_cpu_seconds"] += amounts["ingest_cpu_seconds"]
+                totals["llm_tokens"] += amounts["prompt_tokens"] + amounts["completion_tokens"]
+    return totals
+
+
+def _seconds_until_tomorrow():
+    now = timezone.now()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), dt_time.min, tzinfo=now.tzinfo)
+    return (tomorrow - now).total_seconds()
+
+
+def check_chat_quota(user_id):
+    """
+    Raises QuotaExceeded when the user has used up today's LLM tokens.
+    """
+    if not settings.QUOTA_DAILY_LLM_TOKENS or user_id is None:
+        return
+    if usage_today(user_id)["llm_tokens"] >= settings.QUOTA_DAILY_LLM_TOKENS:
+        metrics.increment("quota.rejected.llm_tokens")
+        raise QuotaExceeded(
+            "You have reached today's question limit. Please try again tomorrow.",
+            retry_after=_seconds_until_tomorrow(),
+        )
+
+
+def check_upload_quota(user_id):
+    """
+    Raises QuotaExceeded when the user is over the vector storage or daily ingestion quota.
+    """
+    if settings.QUOTA_VECTOR_BYTES:
+        stored = UploadDocument.objects.filter(user_id=user_id, deleted=False).aggregate(
+            total=Sum("vector_bytes")
+        )["total"] or 0
+        if stored >= settings.QUOTA_VECTOR_BYTES:
+            metrics.increment("quota.rejected.vector_bytes")
+            raise QuotaExceeded("Your document storage is full. Delete documents to upload new ones.")
+    if settings.QUOTA_DAILY_INGEST_CPU_SECONDS:
+        if usage_today(user_id)["ingest_cpu_seconds"] >= settings.QUOTA_DAILY_INGEST_CPU_SECONDS:
+            metrics.increment("quota.rejected.ingest_cpu")
+            raise QuotaExceeded(
+                "You have reached today's document processing limit. Please try again tomorrow.",
+                retry_after=_seconds_until_tomorrow(),
+            )
+
+
+def usage_report(days):
+    """
+    Usage per user over the last `days` days (today included), plus each user's current storage,
+    heaviest users first. Reads the rollups, so it runs in two grouped queries whatever the traffic.
+    """
+    since = timezone.now().date() - timedelta(days=days - 1)
+    rows = UsageRollup.objects.filter(day__gte=since).values("user_id").annotate(
+        ingest_cpu_seconds=Sum("ingest_cpu_seconds"),
+        chunks_embedded=Sum("chunks_embedded"),
+        llm_calls=Sum("llm_calls"),
+        prompt_tokens=Sum("prompt_tokens"),
+        completion_tokens=Sum("completion_tokens"),
+    )
+    report = {row.pop("user_id"): row for row in rows}
+
+    storage = CustomUser.objects.annotate(
+        documents=Count("uploaddocument", filter=Q(uploaddocument__deleted=False)),
+        chunk_count=Sum("uploaddocument__chunk_count", filter=Q(uploaddocument__deleted=False)),
+        vector_bytes=Sum("uploaddocument__vector_bytes", filter=Q(uploaddocument__deleted=False)),
+    ).filter(Q(id__in=report.keys()) | Q(documents__gt=0)).values_list(
+        "id", "email", "documents", "chunk_count", "vector_bytes"
+    )
+    users = []
+    for user_id, email, documents, chunk_count, vector_bytes in storage:
+        usage = report.get(user_id, {})
+        users.append({
+            "user_id": user_id,
+            "email": email,
+            "documents": documents,
+            "chunk_count": chunk_count or 0,
+            "vector_bytes": vector_bytes or 0,
+            "ingest_cpu_seconds": round(usage.get("ingest_cpu_seconds") or 0, 3),
+            "chunks_embedded": usage.get("chunks_embedded") or 0,
+            "llm_calls": usage.get("llm_calls") or 0,
+            "prompt_tokens": usage.get("prompt_tokens") or 0,
+            "completion_tokens": usage.get("completion_tokens") or 0,
+        })
+    users.sort(
+        key=lambda user: (user["prompt_tokens"] + user["completion_tokens"], user["ingest_cpu_seconds"]), reverse=True
+    )
+    return users
@@ -1,3 +1,27 @@
 from django.contrib import admin
+from .models import UsageRollup
 
 # Register your models here.
+
+
+@admin.register(UsageRollup)
+class UsageRollupAdmin(admin.ModelAdmin):
+    """Read-only: rows are written by accounting.flush()."""
+    list_display = (
+        "day", "user", "document", "ingest_cpu_seconds", "chunks_embedded",
+        "llm_calls", "prompt_tokens", "completion_tokens", "updated_at",
+    )
+    list_filter = ("day",)
+    date_hierarchy = "day"
+    search_fields = ("user__email",)
+    list_select_related = ("user", "document")
+    ordering = ("-day",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
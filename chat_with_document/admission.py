@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Admission control in front of LLM calls:
+#   - per-user token buckets, so one user cannot starve the others
+#   - a cap on concurrent LLM calls in this process
+#   - a bounded wait queue with a deadline; when it is full the request fails fast as "busy"
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted. `reason` is "busy" or "rate_limited"."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queue, queue_timeout, user_rate, user_burst):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._buckets = {}  # user id -> (tokens, last refill time)
+        self._buckets_lock = threading.Lock()
+
+    def take_token(self, user_id):
+        """Spends one of the user's tokens; raises AdmissionRejected("rate_limited") when there is none."""
+        if user_id is None or not self.user_rate:
+            return
+        now = time.monotonic()
+        with self._buckets_lock:
+            tokens, last = self._buckets.get(user_id, (self.user_burst, now))
+            tokens = min(self.user_burst, tokens + (now - last) * self.user_rate)
+            if tokens < 1:
+                self._buckets[user_id] = (tokens, now)
+                metrics.increment("admission.rejected.rate_limited")
+                raise AdmissionRejected("rate_limited", retry_after=(1 - tokens) / self.user_rate)
+            self._buckets[user_id] = (tokens - 1, now)
+            if len(self._buckets) > 10000:
+                # Drop buckets that have refilled completely; they are equivalent to new ones
+                full_after = self.user_burst / self.user_rate
+                self._buckets = {uid: b for uid, b in self._buckets.items() if now - b[1] < full_after}
+
+    def refund_token(self, user_id):
+        """Gives back a token spent by a request that was then rejected as busy."""
+        if user_id is None or not self.user_rate:
+            return
+        with self._buckets_lock:
+            if user_id in self._buckets:
+                tokens, last = self._buckets[user_id]
+                self._buckets[user_id] = (min(self.user_burst, tokens + 1), last)
+
+    def acquire(self, timeout=None):
+        """
+        Takes a concurrency slot, waiting in the bounded queue for up to `timeout` seconds
+        (default queue_timeout). Raises AdmissionRejected("busy") instead of overloading the provider.
+        """
+        started = time.monotonic()
+        with self._condition:
+            if self._active >= self.max_concurrent or self._waiting:
+                if self._waiting >= self.max_queue:
+                    metrics.increment("admission.rejected.busy")
+                    raise AdmissionRejected("busy", retry_after=self.queue_timeout)
+                self._waiting += 1
+                metrics.observe("admission.queue_depth", self._waiting)
+                try:
+                    deadline = started + (self.queue_timeout if timeout is None else timeout)
+                    while self._active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            metrics.increment("admission.rejected.timeout")
+                            raise AdmissionRejected("busy", retry_after=self.queue_timeout)
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._active += 1
+        metrics.observe("admission.wait_seconds", time.monotonic() - started)
+
+    def try_acquire(self):
+        """Takes a slot only if one is free and nobody is queued; returns whether it did."""
+        with self._condition:
+            if self._active >= self.max_concurrent or self._waiting:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self, user_id=None):
+        """Context manager around one LLM call: the user's token, then a slot. A busy rejection costs no token."""
+        self.take_token(user_id)
+        try:
+            self.acquire()
+        except AdmissionRejected:
+            self.refund_token(user_id)
+            raise
+        try:
+            yield
+        finally:
+            self.release()
+
+
+llm_admission = AdmissionController(
+    max_concurrent=settings.LLM_MAX_CONCURRENT,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    user_rate=settings.LLM_USER_RATE,
+    user_burst=settings.LLM_USER_BURST,
+)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChatWithDocumentConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat_with_document"
+
+    def ready(self):
+        from . import signals  # noqa: F401
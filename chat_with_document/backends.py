@@ -1,21 +1,29 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from .cache import get_cached_user
 
 User = get_user_model()
 
+
+# The only authentication backend (USERNAME_FIELD is "email"): one indexed lookup per login,
+# and the per-request user is read from the cache (see cache.get_cached_user).
 class EmailBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
         try:
-            user = User.objects.get(email=username)
+            user = User._default_manager.get(email=username)
         except User.DoesNotExist:
+            # Run the password hasher anyway, so response time does not reveal which emails exist
+            User().set_password(password)
             return None
 
-        if user.check_password(password):
+        if user.check_password(password) and self.user_can_authenticate(user):
             return user
         return None
 
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
\ No newline at end of file
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
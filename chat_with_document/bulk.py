@@ -0,0 +1,388 @@
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .accounting import record_ingestion
+from .models import UploadBatch, UploadDocument
+from .summaries import schedule_document_summary
+from .utils import add_embedded_chunks, drop_collection, file_hash, get_embedding_model, get_vectorstore, load_pdf_pages, split_pages
+
+logger = logging.getLogger(__name__)
+
+
+# Bulk upload: many PDFs (or ZIP archives of PDFs) in one request.
+#   1. create_bulk_upload() stores every file and creates the UploadDocument rows in one transaction
+#   2. after commit, ingest_batch() runs in the background:
+#        - PDFs are parsed and split in parallel (BULK_INGEST_WORKERS threads)
+#        - chunks of all documents are packed into shared embedding batches of BULK_EMBED_BATCH_SIZE,
+#          so a batch of small documents keeps the model as busy as one large document
+#        - each document is marked completed as soon as its last chunk is stored; a document that fails
+#          part way has the chunks stored so far dropped
+#   3. batch_progress() reports aggregate progress
+#   4. batches left "processing" by a process that stopped are re-queued by recover_interrupted_batches(),
+#      which runs in the background of every web process (see start_recovery())
+#
+# Each queued run holds its batch with a run token (UploadBatch.owner). The process that queued it refreshes
+# updated_at while the run waits or works, so only batches of a stopped process go stale; recovery claims
+# them with a new token, and a run that finds another token on its batch stops.
+class BulkUploadError(Exception):
+    """Raised for a rejected bulk upload; `status` is the HTTP status code to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ClaimLost(Exception):
+    """Raised in ingest_batch() when the batch was claimed by another run."""
+
+
+# One batch at a time: the embedding model is the bottleneck, parallelism is inside the batch
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-ingest")
+_recovery = None
+_recovery_lock = threading.Lock()
+# Batches queued or being ingested in this process: batch id -> run token
+_owned = {}
+_owned_lock = threading.Lock()
+
+
+def _iter_pdfs(files):
+    """
+    Yields (filename, declared size, file object) for every PDF among the uploaded files, expanding ZIP archives.
+    A file object is only valid until the next item is requested.
+    """
+    for upload in files:
+        name = os.path.basename(upload.name or "")
+        if name.lower().endswith(".pdf"):
+            yield name, upload.size, upload
+        elif name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(upload)
+            except zipfile.BadZipFile:
+                raise BulkUploadError(f"{name} is not a valid ZIP archive.")
+            with archive:
+                for info in archive.infolist():
+                    member = os.path.basename(info.filename)
+                    # Skip folders, macOS resource forks and anything that is not a PDF
+                    if info.is_dir() or info.filename.startswith("__MACOSX/") or member.startswith("."):
+                        continue
+                    if not member.lower().endswith(".pdf"):
+                        continue
+                    # Extracted before it is stored, so a corrupt member is rejected without leaving a partial file.
+                    # Reads stop at the declared size, so it also bounds what a crafted archive can expand to
+                    with tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE) as f:
+                        try:
+                            with archive.open(info) as source:
+                                shutil.copyfileobj(source, f)
+                        except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                            raise BulkUploadError(f"{name}: {info.filename} is corrupt: {e}")
+                        f.seek(0)
+                        yield member, info.file_size, f
+        else:
+            raise BulkUploadError(f"{name}: only PDF and ZIP files can be uploaded.")
+
+
+def create_bulk_upload(user, files, chunking_strategy=None):
+    """
+    Stores the uploaded PDFs and creates their documents in one transaction; ingestion starts after commit.
+    """
+    if not files:
+        raise BulkUploadError("No files uploaded.")
+    if chunking_strategy and chunking_strategy not in settings.CHUNKING_STRATEGIES:
+        raise BulkUploadError(f"Unknown chunking strategy: {chunking_strategy}")
+
+    saved = []
+    try:
+        with transaction.atomic():
+            batch = UploadBatch.objects.create(user=user, owner=uuid.uuid4())
+            total_size = 0
+            for name, size, f in _iter_pdfs(files):
+                total_size += size
+                if len(saved) >= settings.BULK_UPLOAD_MAX_FILES:
+                    raise BulkUploadError(f"At most {settings.BULK_UPLOAD_MAX_FILES} PDFs per upload.", status=413)
+                if total_size > settings.BULK_UPLOAD_MAX_SIZE:
+                    raise BulkUploadError("Upload is too large.", status=413)
+
+                document = UploadDocument(user=user, batch=batch, status="processing")
+                if chunking_strategy:
+                    document.chunking_strategy = chunking_strategy
+                document.file.save(name, File(f, name=name), save=False)
+                saved.append(document.file.name)
+                document.save()
+
+            if not saved:
+                raise BulkUploadError("No PDF files found in the upload.")
+            batch_id, owner = batch.id, batch.owner
+            transaction.on_commit(lambda: _queue(batch_id, owner))
+    except Exception:
+        # The rows were rolled back; remove the files written so far
+        for name in saved:
+            UploadDocument.file.field.storage.delete(name)
+        raise
+
+    logger.info(f"Bulk upload {batch.id}: {len(saved)} documents queued for user {user.id}")
+    return batch
+
+
+def _prepare(document):
+    """Parses and splits one document. Runs in a worker thread and does not touch the database."""
+    started = time.thread_time()
+    content_hash = document.content_hash or file_hash(document.file.path)
+    pages = load_pdf_pages(document.file.path, content_hash)
+    splits = split_pages(pages, document.chunking_strategy, document.embedding_model_name)
+    if not splits:
+        raise ValueError("No text extracted from PDF.")
+    return content_hash, [page.metadata["page_hash"] for page in pages], splits, time.thread_time() - started
+
+
+def _finish(document, status, cpu_seconds=0, chunks_embedded=0):
+    document.status = status
+    record_ingestion(document, cpu_seconds, chunks_embedded)
+    document.save(update_fields=["status", "content_hash", "page_hashes", "chunk_count", "vector_bytes"])
+    if status == "completed":
+        schedule_document_summary(document)
+
+
+def _discard(document, cpu_seconds=0):
+    """Marks a document failed and drops the chunks already stored for it, so a retry starts clean."""
+    try:
+        drop_collection(document.collection_name)
+    except Exception as e:
+        logger.error(f"Error dropping the collection of failed document {document.id}: {e}", exc_info=True)
+    _finish(document, "failed", cpu_seconds)
+
+
+def _queue(batch_id, owner):
+    with _owned_lock:
+        _owned[batch_id] = owner
+    _executor.submit(_ingest_in_background, batch_id, owner)
+
+
+def _touch(batch_id, owner, **fields):
+    """Updates a batch this run still holds, which also keeps it from going stale; raises ClaimLost otherwise."""
+    if not UploadBatch.objects.filter(id=batch_id, owner=owner).update(updated_at=timezone.now(), **fields):
+        raise ClaimLost(f"Bulk upload {batch_id} was claimed by another run")
+
+
+def _heartbeat():
+    """Touches the batches queued or being ingested in this process, and forgets those claimed elsewhere."""
+    with _owned_lock:
+        owned = list(_owned.items())
+    for batch_id, owner in owned:
+        try:
+            _touch(batch_id, owner)
+        except ClaimLost:
+            with _owned_lock:
+                if _owned.get(batch_id) == owner:
+                    del _owned[batch_id]
+
+
+def _embed_group(batch_id, owner, model_name, group, cpu_seconds):
+    """
+    Embeds the chunks of documents that share an embedding model in shared batches.
+    Small documents are packed together into one batch; large ones span several.
+    `cpu_seconds` maps document ids to CPU time spent on them so far; each batch's CPU time is
+    split between its documents by their share of its chunks.
+    """
+    embedding_model = get_embedding_model(model_name)
+    chunk_counts = {document.id: len(splits) for document, splits in group}
+    remaining = dict(chunk_counts)
+    stores = {}
+    failed = set()
+
+    stream = ((document, chunk) for document, splits in group for chunk in splits)
+    while True:
+        items = list(itertools.islice(stream, settings.BULK_EMBED_BATCH_SIZE))
+        if not items:
+            break
+        items = [item for item in items if item[0].id not in failed]
+        if not items:
+            continue
+
+        started = time.thread_time()
+        try:
+            embeddings = embedding_model.embed_documents([chunk.page_content for _, chunk in items])
+        except Exception as e:
+            logger.error(f"Bulk upload {batch_id}: embedding batch failed: {e}", exc_info=True)
+            for document in {document.id: document for document, _ in items}.values():
+                failed.add(document.id)
+                _discard(document, cpu_seconds[document.id])
+            continue
+
+        # Write each document's slice of the shared batch to its own collection, unless another run took over
+        _touch(batch_id, owner)
+        batch_cpu_seconds = time.thread_time() - started
+        position = 0
+        for _, document_items in itertools.groupby(items, key=lambda item: item[0].id):
+            document_items = list(document_items)
+            document = document_items[0][0]
+            vectors = embeddings[position:position + len(document_items)]
+            position += len(document_items)
+            cpu_seconds[document.id] += batch_cpu_seconds * len(document_items) / len(items)
+            if document.id in failed:
+                continue
+            try:
+                if document.id not in stores:
+                    stores[document.id] = get_vectorstore(
+                        document.collection_name, model_name, chunk_count=chunk_counts[document.id]
+                    )
+                add_embedded_chunks(stores[document.id], [chunk for _, chunk in document_items], vectors)
+            except Exception as e:
+                logger.error(f"Error storing embeddings for document {document.id}: {e}", exc_info=True)
+                failed.add(document.id)
+                _discard(document, cpu_seconds[document.id])
+                continue
+            remaining[document.id] -= len(document_items)
+            if not remaining[document.id]:
+                _finish(document, "completed", cpu_seconds[document.id], chunk_counts[document.id])
+
+        _touch(batch_id, owner, chunks_embedded=F("chunks_embedded") + len(items))
+
+
+def ingest_batch(batch_id, owner):
+    """
+    Ingests every document of a batch that is still processing, as the run holding token `owner`.
+    Raises ClaimLost, without changing anything further, once another run has claimed the batch.
+    """
+    _touch(batch_id, owner)
+    documents = list(UploadDocument.objects.filter(batch_id=batch_id, deleted=False, status="processing"))
+
+    prepared = []
+    cpu_seconds = Counter()
+    with ThreadPoolExecutor(max_workers=settings.BULK_INGEST_WORKERS, thread_name_prefix="bulk-parse") as pool:
+        futures = {pool.submit(_prepare, document): document for document in documents}
+        try:
+            for future in as_completed(futures):
+                _touch(batch_id, owner)
+                document = futures[future]
+                try:
+                    document.content_hash, document.page_hashes, splits, cpu_seconds[document.id] = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing document {document.id}: {e}", exc_info=True)
+                    _finish(document, "failed")
+                    continue
+                prepared.append((document, splits))
+        except ClaimLost:
+            pool.shutdown(cancel_futures=True)
+            raise
+
+    _touch(batch_id, owner, chunks_total=sum(len(splits) for _, splits in prepared))
+    # A shared batch can only mix documents embedded with the same model
+    for model_name in sorted({document.embedding_model_name for document, _ in prepared}):
+        group = [(document, splits) for document, splits in prepared if document.embedding_model_name == model_name]
+        _embed_group(batch_id, owner, model_name, group, cpu_seconds)
+    logger.info(f"Bulk upload {batch_id}: ingested {len(prepared)} of {len(documents)} documents")
+
+
+def _ingest_in_background(batch_id, owner):
+    close_old_connections()
+    try:
+        ingest_batch(batch_id, owner)
+    except ClaimLost:
+        logger.warning(f"Bulk upload {batch_id}: claimed by another run, stopped")
+    except Exception as e:
+        logger.error(f"Error ingesting bulk upload {batch_id}: {e}", exc_info=True)
+        if UploadBatch.objects.filter(id=batch_id, owner=owner).exists():
+            for document in UploadDocument.objects.filter(batch_id=batch_id, deleted=False, status="processing"):
+                _discard(document)
+    finally:
+        with _owned_lock:
+            if _owned.get(batch_id) == owner:
+                del _owned[batch_id]
+        close_old_connections()
+
+
+def recover_interrupted_batches():
+    """
+    Re-queues the batches whose ingestion stopped with their process: documents still "processing" in a
+    batch its process has not touched for BULK_STALE_SECONDS. Chunks stored by the interrupted run are dropped
+    first; a document whose chunks cannot be dropped is marked failed. Returns the re-queued batch ids.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.BULK_STALE_SECONDS)
+    stale = list(
+        UploadBatch.objects.filter(updated_at__lt=cutoff, documents__status="processing", documents__deleted=False)
+        .values_list("id", flat=True).distinct()
+    )
+    requeued = []
+    for batch_id in stale:
+        # Claim the batch with a new run token, so that only one process re-queues it and a late run of the
+        # previous owner stops. Progress restarts with the documents left
+        owner = uuid.uuid4()
+        claimed = UploadBatch.objects.filter(id=batch_id, updated_at__lt=cutoff).update(
+            owner=owner, chunks_embedded=0, updated_at=timezone.now()
+        )
+        if not claimed:
+            continue
+        for document in UploadDocument.objects.filter(batch_id=batch_id, deleted=False, status="processing"):
+            try:
+                drop_collection(document.collection_name)
+            except Exception as e:
+                logger.error(f"Error dropping the partial collection of document {document.id}: {e}", exc_info=True)
+                _finish(document, "failed")
+        _queue(batch_id, owner)
+        requeued.append(batch_id)
+        logger.warning(f"Bulk upload {batch_id}: ingestion was interrupted, re-queued")
+    return requeued
+
+
+def start_recovery():
+    """
+    Starts this process's recovery thread. Several times per BULK_STALE_SECONDS it touches the batches this
+    process holds and runs recover_interrupted_batches().
+    """
+    global _recovery
+    if _recovery is not None:
+        return
+    with _recovery_lock:
+        if _recovery is None:
+            _recovery = threading.Thread(target=_recover_periodically, name="bulk-recovery", daemon=True)
+            _recovery.start()
+
+
+def _recover_periodically():
+    while True:
+        try:
+            _heartbeat()
+            recover_interrupted_batches()
+        except Exception as e:
+            logger.error(f"Error recovering interrupted bulk uploads: {e}", exc_info=True)
+        finally:
+            connection.close()  # Not held while sleeping
+        time.sleep(settings.BULK_STALE_SECONDS / 3)
+
+
+def batch_progress(batch):
+    """
+    Aggregate progress of a batch: documents per status and chunks embedded so far.
+    """
+    documents = batch.documents.filter(deleted=False)
+    counts = dict(documents.order_by().values_list("status").annotate(count=Count("id")))
+    processing = counts.get("processing", 0)
+    return {
+        "batch_id": str(batch.id),
+        "documents": sum(counts.values()),
+        "processing": processing,
+        "completed": counts.get("completed", 0),
+        "failed": counts.get("failed", 0),
+        "chunks_total": batch.chunks_total,
+        "chunks_embedded": batch.chunks_embedded,
+        "done": processing == 0,
+        "failed_documents": [
+            {"id": str(document_id), "name": name}
+            for document_id, name in documents.filter(status="failed").values_list("id", "file")
+        ],
+    }
@@ -0,0 +1,78 @@
+import logging
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from .models import ChatSession, UploadDocument
+
+logger = logging.getLogger(__name__)
+
+
+# Per-user cache for the index page sidebar.
+# Entries are invalidated by the model signals in signals.py.
+def _documents_key(user_id):
+    return f"user:{user_id}:documents"
+
+
+def _latest_session_key(user_id):
+    return f"user:{user_id}:latest_chat_session"
+
+
+def _auth_user_key(user_id):
+    return f"user:{user_id}:auth"
+
+
+# Stored in place of None so that "user has no chat session" is also a cache hit.
+_NO_SESSION = "__none__"
+
+
+def get_user_documents(user):
+    """
+    Returns the user's non-deleted documents, newest first, from the cache when possible.
+    """
+    key = _documents_key(user.pk)
+    documents = cache.get(key)
+    if documents is None:
+        documents = list(UploadDocument.objects.filter(user=user, deleted=False).order_by("-uploaded_at"))
+        cache.set(key, documents, settings.DOCUMENT_LIST_CACHE_TIMEOUT)
+    return documents
+
+
+def get_latest_chat_session(user):
+    """
+    Returns the user's most recent ChatSession (or None), from the cache when possible.
+    """
+    key = _latest_session_key(user.pk)
+    chat_session = cache.get(key)
+    if chat_session is None:
+        chat_session = ChatSession.objects.filter(user=user).order_by('-created_at').first()
+        cache.set(key, chat_session or _NO_SESSION, settings.DOCUMENT_LIST_CACHE_TIMEOUT)
+    return None if chat_session == _NO_SESSION else chat_session
+
+
+def invalidate_user_cache(user_id):
+    """
+    Drops the cached document list and latest session for a user.
+    """
+    cache.delete_many([_documents_key(user_id), _latest_session_key(user_id)])
+    logger.debug(f"Invalidated index cache for user {user_id}")
+
+
+def get_cached_user(user_id):
+    """
+    Returns the user for an authenticated session (or None), from the cache when AUTH_USER_CACHE_TIMEOUT is set.
+    Entries are invalidated by the user post_save signal, so profile and password changes apply at once.
+    """
+    if not settings.AUTH_USER_CACHE_TIMEOUT:
+        return get_user_model()._default_manager.filter(pk=user_id).first()
+    key = _auth_user_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(_auth_user_key(user_id))
+    logger.debug(f"Invalidated cached user {user_id}")
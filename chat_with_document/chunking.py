@@ -0,0 +1,54 @@
+import logging
+from django.conf import settings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+
+# Chunking strategies are configured in settings.CHUNKING_STRATEGIES:
+#   "characters" - RecursiveCharacterTextSplitter measured in characters (the original behaviour)
+#   "tokens"     - measured with the embedding model's tokenizer; chunk_size=None uses the model's
+#                  max sequence length minus the special tokens ([CLS]/[SEP]) the model adds,
+#                  so no chunk is silently truncated at embedding time
+# chunk_overlap may be an absolute size or a fraction of chunk_size (e.g. 0.1).
+def available_strategies():
+    return list(settings.CHUNKING_STRATEGIES)
+
+
+def _tokenizer_and_limit(embedding_model_name=None):
+    # Imported lazily: utils loads the embedding model at import time
+    from .utils import get_embedding_model
+    client = get_embedding_model(embedding_model_name)._client
+    return client.tokenizer, client.max_seq_length
+
+
+def get_text_splitter(strategy=None, embedding_model_name=None):
+    """
+    Builds the text splitter for a named strategy (defaults to settings.DEFAULT_CHUNKING_STRATEGY).
+    Token-based strategies measure chunks with the tokenizer of the given embedding model.
+    """
+    name = strategy or settings.DEFAULT_CHUNKING_STRATEGY
+    try:
+        config = dict(settings.CHUNKING_STRATEGIES[name])
+    except KeyError:
+        raise ValueError(f"Unknown chunking strategy: {name}")
+
+    unit = config.pop("splitter", "characters")
+    chunk_size = config.pop("chunk_size", None)
+    chunk_overlap = config.pop("chunk_overlap", 0)
+
+    if unit == "tokens":
+        tokenizer, max_tokens = _tokenizer_and_limit(embedding_model_name)
+        max_tokens -= tokenizer.num_special_tokens_to_add()
+        chunk_size = min(chunk_size or max_tokens, max_tokens)
+        if isinstance(chunk_overlap, float):
+            chunk_overlap = int(chunk_size * chunk_overlap)
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+            length_function=lambda text: len(tokenizer.tokenize(text)), **config
+        )
+
+    chunk_size = chunk_size or 1000
+    if isinstance(chunk_overlap, float):
+        chunk_overlap = int(chunk_size * chunk_overlap)
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **config)
@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from .models import CustomUser
 from django.contrib.auth.forms import UserCreationForm
 from .models import UploadDocument
@@ -19,9 +20,19 @@ class CustomUserCreationForm(UserCreationForm):
 
 # Upload Document
 class DocumentUploadForm(forms.ModelForm):
+    chunking_strategy = forms.ChoiceField(required=False)
+
     class Meta:
         model = UploadDocument
-        fields = ['file']
+        fields = ['file', 'chunking_strategy']
         widgets = {
             'file': forms.FileInput(attrs={'class': 'form-control'})
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['chunking_strategy'].choices = [(name, name) for name in settings.CHUNKING_STRATEGIES]
+
+    def clean_chunking_strategy(self):
+        # Keep the document's current strategy (or the default) when none is chosen
+        return self.cleaned_data.get('chunking_strategy') or self.instance.chunking_strategy
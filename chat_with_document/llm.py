@@ -0,0 +1,163 @@
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_groq import ChatGroq
+from . import metrics
+from .admission import AdmissionRejected, llm_admission
+
+logger = logging.getLogger(__name__)
+
+
+# LLM calls under a latency SLO:
+#   - every call has a deadline (LLM_TIMEOUT) and failed calls are retried with jittered backoff
+#   - optionally a second, hedged request is fired when the first is slower than the recent p95
+#   - if the primary model has not answered within LLM_SLO_SECONDS, the fallback model answers
+# Every request (first attempt, retry, hedge, fallback) holds its own llm_admission slot until it
+# actually ends, including attempts abandoned after the deadline, so this process never has more
+# than LLM_MAX_CONCURRENT requests at the provider. A request is only submitted once it has its
+# slot and there is one thread per slot, so nothing waits in the executor queue. Futures left
+# over when an answer arrives or the deadline passes are cancelled.
+_executor = ThreadPoolExecutor(max_workers=settings.LLM_MAX_CONCURRENT, thread_name_prefix="llm")
+
+
+class LLMDeadlineExceeded(Exception):
+    pass
+
+
+def _chat_model(model):
+    # Retries are handled here, not by the client
+    return ChatGroq(model=model, timeout=settings.LLM_TIMEOUT, max_retries=0)
+
+
+def _hedge_delay():
+    p95 = metrics.percentile("llm.primary.latency_seconds", 0.95, min_count=20)
+    return settings.LLM_HEDGE_DELAY if p95 is None else p95
+
+
+def _run(chain, inputs, name, usage, release):
+    try:
+        started = time.perf_counter()
+        result = chain.invoke(inputs, config={"callbacks": [usage]})
+        metrics.observe(f"llm.{name}.latency_seconds", time.perf_counter() - started)
+        return result
+    finally:
+        release()
+
+
+def _start(chain, inputs, name, usage):
+    # The slot is released by the request itself, or here if it is cancelled before it runs
+    release = llm_admission.release
+    future = _executor.submit(_run, chain, inputs, name, usage, release)
+    future.add_done_callback(lambda f: f.cancelled() and release())
+    return future
+
+
+def _submit(chain, inputs, name, usage, timeout=None):
+    """
+    Runs one LLM request once it has an admission slot, waiting up to `timeout` (default
+    LLM_QUEUE_TIMEOUT) for it. Raises AdmissionRejected when no slot frees up in time.
+    """
+    llm_admission.acquire(timeout)
+    return _start(chain, inputs, name, usage)
+
+
+def _try_submit(chain, inputs, name, usage):
+    """Like _submit, but only if a slot is free right now; returns None otherwise."""
+    if not llm_admission.try_acquire():
+        return None
+    return _start(chain, inputs, name, usage)
+
+
+def _cancel(futures):
+    for future in futures:
+        future.cancel()
+
+
+def _call_primary(chain, inputs, deadline, usage):
+    """
+    Primary model with bounded retries and an optional hedge. Returns (answer, path).
+    Raises AdmissionRejected when the first attempt gets no slot.
+    """
+    last_error = None
+    futures = {}
+    try:
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            if attempt:
+                backoff = random.uniform(0, settings.LLM_RETRY_BACKOFF * 2 ** attempt)
+                time.sleep(min(backoff, max(0, deadline - time.monotonic())))
+            if time.monotonic() >= deadline:
+                break
+
+            if not attempt:
+                futures = {_submit(chain, inputs, "primary", usage): "primary"}
+            else:
+                try:
+                    futures = {_submit(chain, inputs, "primary", usage, deadline - time.monotonic()): "primary_retry"}
+                except AdmissionRejected:
+                    break
+            hedge_at = time.monotonic() + _hedge_delay() if settings.LLM_HEDGING else None
+            while futures:
+                now = time.monotonic()
+                timeout = deadline - now
+                if hedge_at is not None:
+                    timeout = min(timeout, hedge_at - now)
+                done, _ = wait(futures, timeout=max(0, timeout), return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = futures.pop(future)
+                    if future.exception() is None:
+                        return future.result(), path
+                    last_error = future.exception()
+                    logger.warning(f"LLM {path} attempt failed: {last_error}")
+                if time.monotonic() >= deadline:
+                    raise LLMDeadlineExceeded("Primary model missed the SLO")
+                if futures and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge = _try_submit(chain, inputs, "primary", usage)
+                    if hedge is None:
+                        metrics.increment("llm.hedge_skipped")  # No slot to spare
+                    else:
+                        futures[hedge] = "primary_hedge"
+                        metrics.increment("llm.hedged")
+                    hedge_at = None
+        raise last_error or LLMDeadlineExceeded("Primary model missed the SLO")
+    finally:
+        # Requests that already started keep their slot until they end
+        _cancel(futures)
+
+
+def answer_question(prompt, question, documents):
+    """
+    Answers from the retrieved documents with the primary model, falling back to the fast model
+    when the primary fails or misses the SLO. Returns (answer, path, usage) where path records what
+    served it and usage is the prompt and completion tokens of every attempt, hedges included.
+    Raises AdmissionRejected when no LLM_MAX_CONCURRENT slot frees up in time.
+    """
+    inputs = {"input": question, "context": documents}
+    usage = UsageMetadataCallbackHandler()
+    primary_chain = create_stuff_documents_chain(_chat_model(settings.LLM_PRIMARY_MODEL), prompt)
+    try:
+        answer, path = _call_primary(primary_chain, inputs, time.monotonic() + settings.LLM_SLO_SECONDS, usage)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        if not settings.LLM_FALLBACK_MODEL:
+            raise
+        logger.warning(f"Primary LLM unavailable ({e}); falling back to {settings.LLM_FALLBACK_MODEL}")
+        fallback_chain = create_stuff_documents_chain(_chat_model(settings.LLM_FALLBACK_MODEL), prompt)
+        future = _submit(fallback_chain, inputs, "fallback", usage)
+        try:
+            answer = future.result(timeout=settings.LLM_TIMEOUT)
+        finally:
+            _cancel([future])
+        path = "fallback"
+    metrics.increment(f"llm.served.{path}")
+    # Attempts abandoned after the deadline that finish later are not counted
+    per_model = list(usage.usage_metadata.values())
+    tokens = {
+        "prompt_tokens": sum(model.get("input_tokens", 0) for model in per_model),
+        "completion_tokens": sum(model.get("output_tokens", 0) for model in per_model),
+    }
+    return answer, path, tokens
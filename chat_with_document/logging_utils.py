@@ -0,0 +1,74 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+
+# Logging pipeline used by settings.LOGGING.
+# Request threads only put records on an in-memory queue; a single background
+# listener thread per process does the formatting and the I/O.
+# Processes never rotate files themselves: with several gunicorn workers (or the runserver
+# reloader) each process would rotate the same file and lose records. Logs go to stderr,
+# and optionally to a WatchedFileHandler that reopens the file after an external logrotate.
+_listeners = []
+
+
+def queued_handler(filename=None, console=True, fmt=None, queue_size=10000):
+    """
+    Factory for a non-blocking QueueHandler, referenced from settings.LOGGING via "()".
+
+    Records are handed to a QueueListener that writes them to stderr and, when `filename`
+    is set, appends them to that file (whose directory must exist). When the queue is full,
+    records are dropped instead of blocking the caller.
+    """
+    formatter = logging.Formatter(fmt) if fmt else None
+    targets = []
+    if console:
+        targets.append(logging.StreamHandler(sys.stderr))
+    if filename:
+        targets.append(logging.handlers.WatchedFileHandler(filename, encoding="utf-8", delay=True))
+    for target in targets:
+        if formatter:
+            target.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = _DroppingQueueHandler(log_queue)
+    handler.listener = logging.handlers.QueueListener(log_queue, *targets, respect_handler_level=True)
+    handler.listener.start()
+    _listeners.append(handler.listener)
+    return handler
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the calling thread on a full queue."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class SampledDebugFilter(logging.Filter):
+    """
+    Lets through only a fraction of DEBUG records, used for high-volume retrieval logs.
+    INFO and above always pass.
+    """
+
+    def __init__(self, rate=0.01):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < self.rate
+
+
+@atexit.register
+def _stop_listeners():
+    """Flush pending records on interpreter shutdown."""
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from langchain_chroma import Chroma
+from chat_with_document.chunking import available_strategies
+from chat_with_document.utils import embedding_model, load_pdf_pages, split_pages
+
+
+def _directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares chunking strategies: vectors produced, ingest time, on-disk index size and "
+        "retrieval hit rate on a labeled question set."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "questions",
+            help='JSON file: [{"pdf": "path/to/file.pdf", "question": "...", "pages": [3, 4]}, ...] '
+                 "where pages are the 1-based pages that contain the answer.",
+        )
+        parser.add_argument("--strategies", nargs="+", default=None, help="Strategies to compare (default: all).")
+        parser.add_argument("-k", type=int, default=7, help="Chunks retrieved per question.")
+
+    def handle(self, *args, **options):
+        with open(options["questions"]) as f:
+            questions = json.load(f)
+        strategies = options["strategies"] or available_strategies()
+        unknown = set(strategies) - set(available_strategies())
+        if unknown:
+            raise CommandError(f"Unknown chunking strategies: {', '.join(sorted(unknown))}")
+
+        # Parse each PDF once; every strategy splits the same pages
+        pdf_paths = sorted({item["pdf"] for item in questions})
+        pages = {path: load_pdf_pages(path) for path in pdf_paths}
+
+        self.stdout.write(f"{'strategy':<12}{'vectors':>10}{'ingest s':>10}{'size MB':>10}{'hit rate':>10}")
+        for strategy in strategies:
+            result = self.benchmark(strategy, pages, questions, options["k"])
+            self.stdout.write(
+                f"{strategy:<12}{result['vectors']:>10}{result['ingest_seconds']:>10.1f}"
+                f"{result['size_bytes'] / 1024 / 1024:>10.2f}{result['hit_rate']:>10.1%}"
+            )
+
+    def benchmark(self, strategy, pages, questions, k):
+        persist_directory = tempfile.mkdtemp(prefix=f"chunking_{strategy}_")
+        try:
+            stores = {}
+            vectors = 0
+            started = time.perf_counter()
+            for i, (path, document_pages) in enumerate(pages.items()):
+                splits = split_pages(document_pages, strategy)
+                vectors += len(splits)
+                stores[path] = Chroma.from_documents(
+                    documents=splits, embedding=embedding_model,
+                    persist_directory=persist_directory, collection_name=f"benchmark_{i}",
+                )
+            ingest_seconds = time.perf_counter() - started
+
+            hits = 0
+            for item in questions:
+                results = stores[item["pdf"]].similarity_search(item["question"], k=k)
+                retrieved_pages = {doc.metadata.get("page", -1) + 1 for doc in results}
+                hits += bool(retrieved_pages & set(item["pages"]))
+
+            return {
+                "vectors": vectors,
+                "ingest_seconds": ingest_seconds,
+                "size_bytes": _directory_size(persist_directory),
+                "hit_rate": hits / len(questions) if questions else 0.0,
+            }
+        finally:
+            shutil.rmtree(persist_directory, ignore_errors=True)
@@ -0,0 +1,45 @@
+from chromadb.errors import NotFoundError
+from django.core.management.base import BaseCommand, CommandError
+from chat_with_document.mmap_store import MmapVectorStore
+from chat_with_document.models import UploadDocument
+from chat_with_document.utils import get_embedding_model
+from chat_with_document.vectordb import get_chroma_client
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the embeddings of existing Chroma collections into the memory-mapped "
+        "vector store, without re-embedding. Set VECTOR_STORE_BACKEND=mmap afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("collections", nargs="*", help="Collections to convert (default: all non-deleted documents).")
+        parser.add_argument("--dtype", choices=["float16", "int8"], default=None, help="Overrides MMAP_VECTOR_STORE['dtype'].")
+
+    def handle(self, *args, **options):
+        # Collection name -> embedding model it was built with
+        models = dict(
+            UploadDocument.objects.filter(deleted=False).exclude(collection_name=None)
+            .values_list("collection_name", "embedding_model_name")
+        )
+        collection_names = options["collections"] or list(models)
+        for collection_name in collection_names:
+            try:
+                source = get_chroma_client().get_collection(collection_name)
+            except NotFoundError:
+                if options["collections"]:
+                    raise CommandError(f"Collection {collection_name} does not exist.")
+                # A document whose ingestion failed has a name but no collection
+                self.stdout.write(f"{collection_name}: no collection, skipped")
+                continue
+            embedding_model = get_embedding_model(models.get(collection_name))
+            data = source.get(include=["embeddings", "documents", "metadatas"])
+            if not data["ids"]:
+                self.stdout.write(f"{collection_name}: empty, skipped")
+                continue
+
+            target = MmapVectorStore(collection_name, embedding_model, dtype=options["dtype"])
+            # Converting is idempotent: replace whatever a previous run wrote
+            target.delete(ids=target.get(include=[])["ids"])
+            target.add_embeddings(data["documents"], data["embeddings"], data["metadatas"], data["ids"])
+            self.stdout.write(f"{collection_name}: {len(data['ids'])} vectors converted")
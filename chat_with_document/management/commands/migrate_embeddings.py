@@ -0,0 +1,120 @@
+import hashlib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from chat_with_document.cache import invalidate_user_cache
+from chat_with_document.models import RetiredCollection, UploadDocument
+from chat_with_document.utils import drop_collection, get_vectorstore, load_pdf_pages, split_pages
+
+
+def shadow_collection_name(document, model_name):
+    return f"collection_{document.id}_{hashlib.sha1(model_name.encode()).hexdigest()[:8]}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embeds documents with a new embedding model without downtime. Each document is embedded into "
+        "a shadow collection while the old one keeps serving, then switched over atomically. "
+        "Safe to interrupt and re-run: documents already on the target model are skipped, and old "
+        "collections left by an interrupted run are dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", default=None, help="Target model (default: settings.EMBEDDING_MODEL).")
+        parser.add_argument("--documents", nargs="*", default=None, help="Document ids to migrate (default: all).")
+        parser.add_argument("--batch-size", type=int, default=64, help="Chunks embedded per vector store write.")
+        parser.add_argument(
+            "--max-chunks-per-second", type=float, default=0,
+            help="Throttle so the migration does not starve live ingestion and queries (0: unthrottled).",
+        )
+        parser.add_argument(
+            "--grace-seconds", type=float, default=60,
+            help="Wait after each switch before dropping the old collection, so requests that already opened it can finish.",
+        )
+        parser.add_argument("--keep-old", action="store_true", help="Do not drop the old collections.")
+
+    def handle(self, *args, **options):
+        model_name = options["model"] or settings.EMBEDDING_MODEL
+        documents = (
+            UploadDocument.objects.filter(deleted=False, status="completed")
+            .exclude(collection_name=None).exclude(embedding_model_name=model_name)
+            .order_by("uploaded_at")
+        )
+        if options["documents"]:
+            documents = documents.filter(id__in=options["documents"])
+
+        for document in documents:
+            old_collection = document.collection_name
+            try:
+                new_collection = self.build_shadow(document, model_name, options)
+            except Exception as e:
+                self.stderr.write(f"{document.id}: failed, still served from {old_collection}: {e}")
+                continue
+
+            # Switch only if the document was not replaced or re-processed while we were embedding it
+            with transaction.atomic():
+                switched = UploadDocument.objects.filter(
+                    id=document.id, collection_name=old_collection, content_hash=document.content_hash,
+                ).update(collection_name=new_collection, embedding_model_name=model_name)
+                if switched and not options["keep_old"]:
+                    RetiredCollection.objects.create(name=old_collection)
+            if switched:
+                invalidate_user_cache(document.user_id)
+                self.stdout.write(f"{document.id}: switched {old_collection} -> {new_collection}")
+            else:
+                drop_collection(new_collection)
+                self.stdout.write(f"{document.id}: changed during migration, skipped (re-run to retry)")
+            if not options["keep_old"]:
+                self.drop_retired(options["grace_seconds"], wait=False)
+
+        if not options["keep_old"]:
+            self.drop_retired(options["grace_seconds"], wait=True)
+
+    def drop_retired(self, grace_seconds, wait):
+        """
+        Drops retired collections, oldest first, once requests that opened them before the switch
+        have had grace_seconds to finish. With wait, sleeps until the last one can be dropped.
+        """
+        while True:
+            retired = RetiredCollection.objects.order_by("retired_at").first()
+            if retired is None:
+                return
+            delay = (retired.retired_at + timedelta(seconds=grace_seconds) - timezone.now()).total_seconds()
+            if delay > 0:
+                if not wait:
+                    return
+                time.sleep(delay)
+            drop_collection(retired.name)
+            retired.delete()
+            self.stdout.write(f"Dropped old collection {retired.name}")
+
+    def build_shadow(self, document, model_name, options):
+        """Embeds the document into a fresh shadow collection and returns its name."""
+        collection_name = shadow_collection_name(document, model_name)
+        # Leftovers of an interrupted run are rebuilt from scratch. Migrating back to an earlier model
+        # reuses its collection name, which must then no longer be dropped as retired.
+        RetiredCollection.objects.filter(name=collection_name).delete()
+        drop_collection(collection_name)
+
+        # The extracted-text cache makes this cheap when the PDF was already parsed
+        pages = load_pdf_pages(document.file.path, document.content_hash or None)
+        if not pages:
+            raise ValueError("No text extracted from PDF.")
+        splits = split_pages(pages, document.chunking_strategy, model_name)
+
+        vectorstore = get_vectorstore(collection_name, model_name, chunk_count=len(splits))
+        batch_size = options["batch_size"]
+        rate = options["max_chunks_per_second"]
+        started = time.monotonic()
+        for i in range(0, len(splits), batch_size):
+            vectorstore.add_documents(splits[i:i + batch_size])
+            if rate:
+                # Sleep off any lead over the allowed rate
+                done = min(i + batch_size, len(splits))
+                delay = done / rate - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        return collection_name
@@ -0,0 +1,142 @@
+import itertools
+import shutil
+import tempfile
+import time
+import chromadb
+import numpy as np
+from chromadb.api.shared_system_client import SharedSystemClient
+from chromadb.errors import NotFoundError
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chat_with_document.management.commands.benchmark_chunking import _directory_size
+from chat_with_document.utils import hnsw_params
+from chat_with_document.vectordb import get_chroma_client
+
+
+def _exact_neighbours(embeddings, queries, k, space):
+    """Brute-force top-k ids (row numbers) for each query, the ground truth for recall."""
+    if space == "l2":
+        distances = (
+            (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ embeddings.T + (embeddings ** 2).sum(axis=1)[None, :]
+        )
+    else:
+        # "cosine" and "ip" both rank by inner product once vectors are normalized for cosine
+        if space == "cosine":
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        distances = -(queries @ embeddings.T)
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds a Chroma collection's vectors under a grid of HNSW parameters and reports build time, "
+        "index size, query latency and recall@k against exact search. Each (M, construction_ef) index is "
+        "built once and queried with every search_ef; the query vectors are held out of the index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("collection", help="Collection to sweep (its stored embeddings are re-used).")
+        parser.add_argument("--m", type=int, nargs="+", default=[16, 32, 48], help="hnsw:M values.")
+        parser.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200, 400], help="hnsw:construction_ef values.")
+        parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100, 200], help="hnsw:search_ef values.")
+        parser.add_argument("-k", type=int, default=7, help="Neighbours per query (the retriever's k).")
+        parser.add_argument(
+            "--queries", type=int, default=200,
+            help="Stored chunks held out of the index and used as queries (at most half of the collection).",
+        )
+        parser.add_argument("--target-recall", type=float, default=0.95, help="Recall the recommendation must reach.")
+
+    def handle(self, *args, **options):
+        if settings.VECTOR_STORE_BACKEND != "chroma":
+            raise CommandError("HNSW parameters only apply to the Chroma backend.")
+        try:
+            source = get_chroma_client().get_collection(options["collection"])
+        except NotFoundError:
+            raise CommandError(f"Collection {options['collection']} does not exist.")
+        data = source.get(include=["embeddings"])
+        if len(data["ids"]) < 2:
+            raise CommandError(f"Collection {options['collection']} has too few vectors to sweep.")
+
+        # Queries are chunks that are not in the index, like real questions: a stored chunk queried
+        # against an index containing it finds itself, which flatters recall
+        embeddings = np.asarray(data["embeddings"], dtype=np.float32)
+        space = (source.metadata or {}).get("hnsw:space", "l2")
+        rng = np.random.default_rng(0)
+        held_out = rng.choice(len(embeddings), size=min(options["queries"], len(embeddings) // 2), replace=False)
+        queries = embeddings[held_out]
+        embeddings = np.delete(embeddings, held_out, axis=0)
+        k = min(options["k"], len(embeddings))
+        truth = _exact_neighbours(embeddings, queries, k, space)
+
+        self.stdout.write(
+            f"{len(embeddings)} vectors, space={space}, k={k}, {len(queries)} queries; "
+            f"ingestion would use {hnsw_params(len(embeddings) + len(queries))}"
+        )
+        self.stdout.write(
+            f"{'M':>4}{'c_ef':>6}{'s_ef':>6}{'build s':>10}{'size MB':>10}{'p50 ms':>9}{'p95 ms':>9}{'recall':>9}"
+        )
+        results = []
+        for m, construction_ef in itertools.product(options["m"], options["construction_ef"]):
+            params = {"hnsw:space": space, "hnsw:M": m, "hnsw:construction_ef": construction_ef}
+            persist_directory = tempfile.mkdtemp(prefix="hnsw_sweep_")
+            try:
+                build_seconds = self.build(persist_directory, embeddings, params)
+                size_bytes = _directory_size(persist_directory)
+                for search_ef in options["search_ef"]:
+                    result = {
+                        "params": {**params, "hnsw:search_ef": search_ef},
+                        "build_seconds": build_seconds,
+                        "size_bytes": size_bytes,
+                        **self.measure(persist_directory, search_ef, queries, truth, k),
+                    }
+                    results.append(result)
+                    self.stdout.write(
+                        f"{m:>4}{construction_ef:>6}{search_ef:>6}{build_seconds:>10.2f}"
+                        f"{size_bytes / 1024 / 1024:>10.2f}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                        f"{result['recall']:>9.1%}"
+                    )
+            finally:
+                SharedSystemClient.clear_system_cache()
+                shutil.rmtree(persist_directory, ignore_errors=True)
+
+        good = [result for result in results if result["recall"] >= options["target_recall"]]
+        if good:
+            best = min(good, key=lambda result: result["p95_ms"])
+            params = {key: value for key, value in best["params"].items() if key != "hnsw:space"}
+            self.stdout.write(f"Fastest config with recall >= {options['target_recall']:.0%}: {params}")
+        else:
+            self.stdout.write(f"No config reached recall {options['target_recall']:.0%}; try larger search_ef values.")
+
+    def build(self, persist_directory, embeddings, params):
+        """Builds the index in `persist_directory` and returns the build time in seconds."""
+        client = chromadb.PersistentClient(path=persist_directory)
+        collection = client.create_collection("sweep", metadata=params)
+        ids = [str(i) for i in range(len(embeddings))]
+        batch_size = client.get_max_batch_size()
+
+        started = time.perf_counter()
+        for i in range(0, len(ids), batch_size):
+            collection.add(ids=ids[i:i + batch_size], embeddings=embeddings[i:i + batch_size].tolist())
+        return time.perf_counter() - started
+
+    def measure(self, persist_directory, search_ef, queries, truth, k):
+        """Query latency and recall of the built index with `search_ef`."""
+        client = chromadb.PersistentClient(path=persist_directory)
+        client.get_collection("sweep").modify(configuration={"hnsw": {"ef_search": search_ef}})
+        # A loaded index keeps its search_ef, so the index is reopened to apply it
+        SharedSystemClient.clear_system_cache()
+        collection = chromadb.PersistentClient(path=persist_directory).get_collection("sweep")
+        collection.query(query_embeddings=[queries[0].tolist()], n_results=k, include=[])  # Loads the index
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            found = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len({int(i) for i in found} & set(expected.tolist()))
+        return {
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "recall": hits / (len(queries) * k),
+        }
@@ -0,0 +1,52 @@
+import threading
+from collections import Counter, defaultdict, deque
+
+
+# In-process metrics: rolling windows of recent observations plus monotonic counters.
+# Each worker process keeps its own; read them through the staff-only /metrics/ view.
+WINDOW_SIZE = 1000
+
+_lock = threading.Lock()
+_observations = defaultdict(lambda: deque(maxlen=WINDOW_SIZE))
+_counters = Counter()
+
+
+def observe(name, value):
+    """Records one observation (e.g. a latency in seconds or a score) for `name`."""
+    with _lock:
+        _observations[name].append(value)
+
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def percentile(name, fraction, min_count=1):
+    """Percentile of the recent window of `name`, or None with fewer than `min_count` observations."""
+    with _lock:
+        values = sorted(_observations.get(name, ()))
+    if len(values) < max(min_count, 1):
+        return None
+    return _percentile(values, fraction)
+
+
+def snapshot():
+    """Count and p50/p95/max over the recent window of each metric, plus counters."""
+    with _lock:
+        windows = {name: sorted(values) for name, values in _observations.items()}
+        counters = dict(_counters)
+    summaries = {
+        name: {
+            "count": len(values),
+            "p50": _percentile(values, 0.5),
+            "p95": _percentile(values, 0.95),
+            "max": values[-1],
+        }
+        for name, values in windows.items() if values
+    }
+    return {"observations": summaries, "counters": counters}
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp'], name='chatmessage_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', '-created_at'], name='chatsession_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploaddocument',
+            index=models.Index(fields=['user', 'deleted', '-uploaded_at'], name='uploaddoc_user_del_upl_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0003_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploaddocument',
+            name='page_hashes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
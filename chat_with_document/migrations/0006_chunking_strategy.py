@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 13:30
+
+import chat_with_document.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0005_document_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploaddocument',
+            name='chunking_strategy',
+            field=models.CharField(default=chat_with_document.models.default_chunking_strategy, max_length=50),
+        ),
+    ]
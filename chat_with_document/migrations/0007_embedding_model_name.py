@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 14:00
+
+import chat_with_document.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0006_chunking_strategy'),
+    ]
+
+    operations = [
+        # Existing collections were all embedded with the model that used to be hard-coded in utils.py
+        migrations.AddField(
+            model_name='uploaddocument',
+            name='embedding_model_name',
+            field=models.CharField(default='sentence-transformers/all-MiniLM-L12-v2', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='uploaddocument',
+            name='embedding_model_name',
+            field=models.CharField(default=chat_with_document.models.default_embedding_model, max_length=255),
+        ),
+    ]
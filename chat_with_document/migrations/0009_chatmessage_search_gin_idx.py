@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 16:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # An expression index rather than a stored column: adding a stored generated column rewrites
+    # chat_message under an ACCESS EXCLUSIVE lock, while this only builds the index, without blocking writes
+    atomic = False
+
+    dependencies = [
+        ('chat_with_document', '0008_upload_batch'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='chatmessage',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('user_message', config='english', weight='A'), '||', django.contrib.postgres.search.SearchVector('bot_response', config='english', weight='B'), django.contrib.postgres.search.SearchConfig('english')), name='chatmessage_search_gin_idx'),
+        ),
+    ]
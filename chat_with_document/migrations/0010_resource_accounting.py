@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-19 17:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0009_chatmessage_search_gin_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploaddocument',
+            name='chunk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploaddocument',
+            name='vector_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('ingest_cpu_seconds', models.FloatField(default=0)),
+                ('chunks_embedded', models.PositiveBigIntegerField(default=0)),
+                ('llm_calls', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0)),
+                ('completion_tokens', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='chat_with_document.uploaddocument')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='usagerollup_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'day', 'document'), name='usagerollup_user_day_doc_uniq', nulls_distinct=False)],
+            },
+        ),
+    ]
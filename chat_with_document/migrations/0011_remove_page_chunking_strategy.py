@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-19 18:00
+
+from django.db import migrations
+
+
+def page_to_token(apps, schema_editor):
+    # "page" was "token" without overlap; re-indexing such documents now uses "token"
+    UploadDocument = apps.get_model('chat_with_document', 'UploadDocument')
+    UploadDocument.objects.filter(chunking_strategy='page').update(chunking_strategy='token')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0010_resource_accounting'),
+    ]
+
+    operations = [
+        migrations.RunPython(page_to_token, migrations.RunPython.noop),
+    ]
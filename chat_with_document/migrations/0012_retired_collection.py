@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0011_remove_page_chunking_strategy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetiredCollection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('retired_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
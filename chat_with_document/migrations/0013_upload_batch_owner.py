@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_with_document', '0012_retired_collection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadbatch',
+            name='owner',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
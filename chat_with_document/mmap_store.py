@@ -0,0 +1,458 @@
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+
+# Memory-mapped vector store.
+#
+# Each collection is a directory of immutable segments and a manifest.json listing them:
+#   <segment>/vectors.npy  float16, or int8 with a per-vector scale in scales.npy
+#   <segment>/full.npy     optional float32 copy, only read for re-scoring the top candidates
+#   <segment>/chunks.jsonl id, text and metadata per chunk; offsets.npy indexes its lines, ids.json lists the ids
+# The manifest also holds each segment's deleted rows (tombstones). Adding chunks writes one new
+# segment; deleting only adds tombstones; a metadata update tombstones the rows and appends them again.
+# Segments are merged size-tiered (a segment is merged into the previous one once it is at least
+# half its size), so a chunk is rewritten O(log n) times however it was ingested, and everything is
+# rewritten once tombstones make up half the rows.
+# Files are opened with np.load(mmap_mode="r"), so opening is near-instant and pages are shared
+# between worker processes through the OS page cache. Writers hold a per-collection file lock
+# while they change the segments and swap the manifest.
+_SCORE_BLOCK_ROWS = 65536
+
+_snapshots = {}
+_segments = {}
+_snapshots_lock = threading.Lock()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _matches(metadata, where):
+    for key, condition in (where or {}).items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _live(entry):
+    return entry["count"] - len(entry["deleted"])
+
+
+class _Segment:
+    """Memory-mapped arrays of one immutable segment."""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r") if dtype == "int8" else None
+        self.full = None
+        if os.path.exists(os.path.join(path, "full.npy")):
+            self.full = np.load(os.path.join(path, "full.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "chunks.jsonl"), "rb") as f:
+            self._chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._ids = None
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            try:
+                with open(os.path.join(self.path, "ids.json")) as f:
+                    self._ids = json.load(f)
+            except FileNotFoundError:  # Written before ids.json existed
+                self._ids = [self.chunk(row)["id"] for row in range(len(self.offsets) - 1)]
+        return self._ids
+
+    def dequantize(self, rows):
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= np.asarray(self.scales[rows], dtype=np.float32)[:, None]
+        return vectors
+
+    def full_precision(self, rows):
+        """Full-precision vectors for the given rows if stored, otherwise the dequantized ones."""
+        if self.full is not None:
+            return np.asarray(self.full[rows], dtype=np.float32)
+        return self.dequantize(rows)
+
+    def chunk(self, row):
+        return json.loads(self._chunks[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+
+def _load_segment(directory, name, dtype):
+    path = os.path.join(directory, name)
+    with _snapshots_lock:
+        segment = _segments.get(path)
+        if segment is None:
+            segment = _segments[path] = _Segment(path, dtype)
+    return segment
+
+
+def _write_segment(path, chunks, vectors, dtype, rescore):
+    """Writes chunks and their normalized float32 vectors as a segment directory."""
+    os.makedirs(path)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        np.save(os.path.join(path, "vectors.npy"), np.round(vectors / scales[:, None]).astype(np.int8))
+        np.save(os.path.join(path, "scales.npy"), scales.astype(np.float32))
+    else:
+        np.save(os.path.join(path, "vectors.npy"), vectors.astype(np.float16))
+    if rescore:
+        np.save(os.path.join(path, "full.npy"), vectors.astype(np.float32))
+
+    offsets = [0]
+    with open(os.path.join(path, "chunks.jsonl"), "wb") as f:
+        for chunk in chunks:
+            line = json.dumps(chunk).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(path, "ids.json"), "w") as f:
+        json.dump([chunk["id"] for chunk in chunks], f)
+
+
+class _Snapshot:
+    """
+    The segments of one manifest version. Rows are numbered across segments in manifest order;
+    `size` counts all rows, `count` only those not deleted.
+    """
+
+    def __init__(self, directory, manifest):
+        self.version = manifest["version"]
+        self.dim = manifest.get("dim", 0)
+        entries = manifest["segments"]
+        self.segments = [_load_segment(directory, entry["name"], manifest["dtype"]) for entry in entries]
+        self.starts = np.cumsum([0] + [entry["count"] for entry in entries])
+        self.size = int(self.starts[-1])
+        self.alive = None
+        deleted = [int(start) + row for entry, start in zip(entries, self.starts) for row in entry["deleted"]]
+        if deleted:
+            self.alive = np.ones(self.size, dtype=bool)
+            self.alive[deleted] = False
+        self.count = self.size - len(deleted)
+        self.has_full = bool(self.segments) and all(segment.full is not None for segment in self.segments)
+
+    def live_rows(self):
+        return np.arange(self.size) if self.alive is None else np.flatnonzero(self.alive)
+
+    def _gather(self, rows, read):
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+        owners = np.searchsorted(self.starts, rows, side="right") - 1
+        for owner in np.unique(owners):
+            mask = owners == owner
+            vectors[mask] = read(self.segments[owner], rows[mask] - self.starts[owner])
+        return vectors
+
+    def dequantize(self, rows):
+        return self._gather(rows, _Segment.dequantize)
+
+    def full_precision(self, rows):
+        return self._gather(rows, _Segment.full_precision)
+
+    def scores(self, query):
+        """Approximate cosine similarity of every live vector with a normalized query (-inf for deleted rows)."""
+        scores = np.empty(self.size, dtype=np.float32)
+        for segment, start in zip(self.segments, self.starts):
+            for offset in range(0, len(segment.vectors), _SCORE_BLOCK_ROWS):
+                rows = slice(offset, offset + _SCORE_BLOCK_ROWS)
+                block = segment.dequantize(rows) @ query
+                scores[start + offset:start + offset + len(block)] = block
+        if self.alive is not None:
+            scores[~self.alive] = -np.inf
+        return scores
+
+    def chunk(self, row):
+        owner = int(np.searchsorted(self.starts, row, side="right")) - 1
+        return self.segments[owner].chunk(int(row - self.starts[owner]))
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Vector store backed by memory-mapped float16/int8 arrays, selected with VECTOR_STORE_BACKEND = "mmap".
+    """
+
+    def __init__(self, collection_name, embedding_function, path=None, dtype=None, rescore=None, rescore_candidates=None):
+        config = settings.MMAP_VECTOR_STORE
+        self.collection_name = collection_name
+        self.directory = os.path.join(path or config["path"], collection_name)
+        self.dtype = dtype or config["dtype"]
+        self.rescore = config["rescore"] if rescore is None else rescore
+        self.rescore_candidates = rescore_candidates or config["rescore_candidates"]
+        self._embedding = embedding_function
+        if self.dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector dtype: {self.dtype}")
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # Storage
+    def _manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"version": None, "dtype": self.dtype, "dim": 0, "segments": []}
+        if "segments" not in manifest:
+            # Single-version layout written before segments: the version directory is the only segment
+            count = manifest.pop("count")
+            manifest["segments"] = [{"name": manifest["version"], "count": count, "deleted": []}] if count else []
+        return manifest
+
+    def _snapshot(self):
+        manifest = self._read_manifest()
+        with _snapshots_lock:
+            snapshot = _snapshots.get(self.directory)
+        if snapshot is None or snapshot.version != manifest["version"]:
+            snapshot = _Snapshot(self.directory, manifest)
+            with _snapshots_lock:
+                _snapshots[self.directory] = snapshot
+                # Forget segments that were merged away
+                names = {os.path.join(self.directory, entry["name"]) for entry in manifest["segments"]}
+                for path in [path for path in _segments if os.path.dirname(path) == self.directory]:
+                    if path not in names:
+                        del _segments[path]
+        return snapshot
+
+    @contextmanager
+    def _locked(self):
+        """Serializes writers of this collection, across threads and processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _new_segment(self, manifest, chunks, vectors):
+        if manifest["dim"] and vectors.shape[1] != manifest["dim"]:
+            raise ValueError(f"Expected {manifest['dim']}-dimensional vectors, got {vectors.shape[1]}")
+        manifest["dim"] = int(vectors.shape[1])
+        name = uuid.uuid4().hex
+        _write_segment(os.path.join(self.directory, name), chunks, vectors, manifest["dtype"], self.rescore)
+        return {"name": name, "count": len(chunks), "deleted": []}
+
+    def _live_data(self, manifest, entries):
+        """Chunks and full-precision vectors of the live rows of the given manifest entries."""
+        chunks, parts = [], []
+        for entry in entries:
+            segment = _load_segment(self.directory, entry["name"], manifest["dtype"])
+            deleted = set(entry["deleted"])
+            rows = [row for row in range(entry["count"]) if row not in deleted]
+            if rows:
+                chunks.extend(segment.chunk(row) for row in rows)
+                parts.append(segment.full_precision(rows))
+        return chunks, parts
+
+    def _merge(self, manifest, start):
+        """Rewrites the segments from `start` on into one segment holding only their live rows."""
+        chunks, parts = self._live_data(manifest, manifest["segments"][start:])
+        merged = [self._new_segment(manifest, chunks, np.concatenate(parts))] if chunks else []
+        manifest["segments"][start:] = merged
+
+    def _compact(self, manifest):
+        segments = manifest["segments"]
+        if sum(len(entry["deleted"]) for entry in segments) * 2 >= sum(entry["count"] for entry in segments) > 0:
+            self._merge(manifest, 0)
+            return
+        while len(segments) > 1 and _live(segments[-1]) * 2 >= _live(segments[-2]):
+            self._merge(manifest, len(segments) - 2)
+
+    def _commit(self, manifest):
+        """Swaps in the new manifest and removes segments it no longer references. Called with the lock held."""
+        manifest["version"] = uuid.uuid4().hex
+        tmp_manifest = self._manifest_path() + ".tmp"
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, self._manifest_path())
+
+        # Only writers create segments, and they hold the lock, so anything unreferenced is garbage.
+        # Readers that still map a removed segment keep working until they close it.
+        referenced = {entry["name"] for entry in manifest["segments"]}
+        for entry in os.listdir(self.directory):
+            if entry not in referenced and os.path.isdir(os.path.join(self.directory, entry)):
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def _find_rows(self, manifest, ids):
+        """(entry, row) of every live row whose chunk id is in `ids`."""
+        found = []
+        for entry in manifest["segments"]:
+            segment = _load_segment(self.directory, entry["name"], manifest["dtype"])
+            deleted = set(entry["deleted"])
+            found.extend(
+                (entry, row) for row, chunk_id in enumerate(segment.ids) if chunk_id in ids and row not in deleted
+            )
+        return found
+
+    # Writing
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """Adds pre-computed embeddings, e.g. when converting an existing Chroma collection."""
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        new_chunks = [
+            {"id": chunk_id, "text": text, "metadata": metadata or {}}
+            for chunk_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        vectors = _normalize(embeddings)
+        with self._locked():
+            manifest = self._read_manifest()
+            manifest["segments"].append(self._new_segment(manifest, new_chunks, vectors))
+            self._compact(manifest)
+            self._commit(manifest)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, collection_name="langchain", **kwargs):
+        store = cls(collection_name, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    def delete(self, ids=None, **kwargs):
+        if ids is None:
+            return False
+        ids = set(ids)
+        with self._locked():
+            manifest = self._read_manifest()
+            found = self._find_rows(manifest, ids)
+            if not found:
+                return True
+            for entry, row in found:
+                entry["deleted"].append(row)
+            self._compact(manifest)
+            self._commit(manifest)
+        return True
+
+    def delete_collection(self):
+        """Removes the collection directory (same name as Chroma's method)."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with _snapshots_lock:
+            _snapshots.pop(self.directory, None)
+            for path in [path for path in _segments if os.path.dirname(path) == self.directory]:
+                del _segments[path]
+
+    def update_metadatas(self, ids, metadatas):
+        """Replaces chunk metadata without re-embedding: the rows are re-appended with their stored vectors."""
+        new_metadata = dict(zip(ids, metadatas))
+        with self._locked():
+            manifest = self._read_manifest()
+            found = self._find_rows(manifest, set(new_metadata))
+            if not found:
+                return
+            chunks, parts = [], []
+            for entry, row in found:
+                segment = _load_segment(self.directory, entry["name"], manifest["dtype"])
+                chunk = segment.chunk(row)
+                chunks.append(dict(chunk, metadata=new_metadata[chunk["id"]]))
+                parts.append(segment.full_precision([row]))
+                entry["deleted"].append(row)
+            manifest["segments"].append(self._new_segment(manifest, chunks, np.concatenate(parts)))
+            self._compact(manifest)
+            self._commit(manifest)
+
+    def get(self, where=None, include=("metadatas", "documents")):
+        """Chroma-style get(), used by re-indexing and by the converter."""
+        snapshot = self._snapshot()
+        chunks, rows = [], []
+        for row in snapshot.live_rows():
+            chunk = snapshot.chunk(row)
+            if _matches(chunk["metadata"], where):
+                chunks.append(chunk)
+                rows.append(row)
+        result = {"ids": [chunk["id"] for chunk in chunks]}
+        if "metadatas" in include:
+            result["metadatas"] = [chunk["metadata"] for chunk in chunks]
+        if "documents" in include:
+            result["documents"] = [chunk["text"] for chunk in chunks]
+        if "embeddings" in include:
+            result["embeddings"] = snapshot.full_precision(rows) if rows else []
+        return result
+
+    # Searching
+    def _top_rows(self, snapshot, query, k):
+        """Top-k rows by quantized score, optionally re-scored at full precision over a larger candidate set."""
+        if not snapshot.count:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = snapshot.scores(query)
+        rescore = self.rescore and snapshot.has_full
+        n = min(max(k, self.rescore_candidates) if rescore else k, snapshot.count)
+        rows = np.argpartition(-scores, n - 1)[:n]
+        if rescore:
+            rows = np.sort(rows)  # sequential reads from the memory map
+            row_scores = snapshot.full_precision(rows) @ query
+        else:
+            row_scores = scores[rows]
+        order = np.argsort(-row_scores)[:k]
+        return rows[order], row_scores[order]
+
+    def _document(self, snapshot, row):
+        chunk = snapshot.chunk(row)
+        return Document(page_content=chunk["text"], metadata=chunk["metadata"], id=chunk["id"])
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        snapshot = self._snapshot()
+        rows, scores = self._top_rows(snapshot, _normalize(embedding), k)
+        return [(self._document(snapshot, row), float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities in [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        snapshot = self._snapshot()
+        query = _normalize(embedding)
+        rows, _ = self._top_rows(snapshot, query, fetch_k)
+        if not len(rows):
+            return []
+        rows = np.sort(rows)
+        candidates = snapshot.full_precision(rows)
+        selected = maximal_marginal_relevance(query, list(candidates), k=min(k, len(rows)), lambda_mult=lambda_mult)
+        return [self._document(snapshot, rows[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k, fetch_k, lambda_mult
+        )
@@ -1,4 +1,6 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.db import models
 import uuid
 from Smart_Document_Chat_App import settings
@@ -33,6 +35,14 @@ class BaseModelManager(models.Manager):
 
 
 
+def default_chunking_strategy():
+    return settings.DEFAULT_CHUNKING_STRATEGY
+
+
+def default_embedding_model():
+    return settings.EMBEDDING_MODEL
+
+
 class UploadDocument(BaseModel):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -41,6 +51,19 @@ class UploadDocument(BaseModel):
     collection_name = models.CharField(max_length=255, unique=True, blank=True, null=True)
     processed = models.BooleanField(default=False)
     status = models.CharField(max_length=20, choices=[("pending", "Pending"), ("processed", "Processed"), ("error", "Error")], default="pending")
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True)  # SHA-256 of the file
+    page_hashes = models.JSONField(default=list, blank=True)  # Hash of each page's extracted text, in page order
+    chunking_strategy = models.CharField(max_length=50, default=default_chunking_strategy)  # Key of settings.CHUNKING_STRATEGIES
+    embedding_model_name = models.CharField(max_length=255, default=default_embedding_model)  # Model the collection was embedded with
+    batch = models.ForeignKey('UploadBatch', on_delete=models.SET_NULL, null=True, blank=True, related_name='documents')
+    chunk_count = models.PositiveIntegerField(default=0)  # Chunks in the collection after the last ingestion
+    vector_bytes = models.BigIntegerField(default=0)  # Vector storage used by the collection, see accounting.py
+
+    class Meta:
+        indexes = [
+            # Sidebar listing: filter(user=..., deleted=False).order_by("-uploaded_at")
+            models.Index(fields=["user", "deleted", "-uploaded_at"], name="uploaddoc_user_del_upl_idx"),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.collection_name:
@@ -48,7 +71,95 @@ class UploadDocument(BaseModel):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.file.name} uploaded by {self.user.username}"
+        return f"{self.file.name} uploaded by user {self.user_id}"
+
+
+# Summary, key points and suggested questions built in the background at ingestion time
+class DocumentSummary(models.Model):
+    document = models.OneToOneField('UploadDocument', on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    summary = models.TextField(blank=True)
+    key_points = models.TextField(blank=True)
+    suggested_questions = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, default="pending", choices=[
+        ("pending", "Pending"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ])
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of document {self.document_id} ({self.status})"
+
+
+# A bulk upload of many PDFs (or ZIP archives of PDFs), ingested together
+class UploadBatch(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    chunks_total = models.PositiveIntegerField(default=0)  # Known once all documents are split
+    chunks_embedded = models.PositiveIntegerField(default=0)
+    owner = models.UUIDField(null=True, blank=True)  # Run token of the ingestion that holds the batch, see bulk.py
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"UploadBatch {self.id} by user {self.user_id}"
+
+
+# A collection migrate_embeddings switched a document away from, dropped once its grace period is over.
+# Recorded in the same transaction as the switch, so an interrupted run never leaks it.
+class RetiredCollection(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    retired_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"RetiredCollection {self.name} (retired {self.retired_at})"
+
+
+# Daily per-user, per-document resource usage, written in periodic rollups by accounting.py
+class UsageRollup(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    document = models.ForeignKey('UploadDocument', on_delete=models.SET_NULL, null=True, blank=True)
+    day = models.DateField()
+    ingest_cpu_seconds = models.FloatField(default=0)  # Lower bound: CPU of the ingesting threads only, see accounting.py
+    chunks_embedded = models.PositiveBigIntegerField(default=0)
+    llm_calls = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "day", "document"], name="usagerollup_user_day_doc_uniq", nulls_distinct=False
+            ),
+        ]
+        indexes = [
+            # Admin report: all users over a date range
+            models.Index(fields=["day"], name="usagerollup_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"Usage of user {self.user_id} on {self.day} for document {self.document_id}"
+
+
+# Resumable chunked upload of a single file; the UploadDocument is only created on finalize.
+class ChunkedUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    offset = models.BigIntegerField(default=0)  # Bytes received so far
+    status = models.CharField(max_length=20, default="uploading", choices=[
+        ("uploading", "Uploading"),
+        ("complete", "Complete"),
+    ])
+    document = models.OneToOneField('UploadDocument', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"ChunkedUpload {self.id} - {self.filename} ({self.offset}/{self.size})"
 
 
 #     Rag Chat App
@@ -67,9 +178,23 @@ class ChatSession(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='chatsession_user_created_idx'),
+        ]
 
     def __str__(self):
-        return f"Chat {self.id} - {self.document.file.name}"
+        return f"Chat {self.id} - Document {self.document_id}"
+
+
+def chat_message_search_vector():
+    """
+    Full-text search document of a chat message; questions rank above answers. Queries must use
+    this exact expression to be served by the GIN index on it.
+    """
+    return (
+        SearchVector('user_message', weight='A', config='english')
+        + SearchVector('bot_response', weight='B', config='english')
+    )
 
 
 # Chat Messages Model (Stores Chat History)
@@ -79,6 +204,12 @@ class ChatMessage(models.Model):
     user_message = models.TextField()
     bot_response = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'timestamp'], name='chatmessage_session_ts_idx'),
+            # Expression index, created concurrently by migration 0009, see search.py
+            GinIndex(chat_message_search_vector(), name='chatmessage_search_gin_idx'),
+        ]
 
     def __str__(self):
-        return f"ChatMessage {self.id} - Session {self.session.id}"
+        return f"ChatMessage {self.id} - Session {self.session_id}"
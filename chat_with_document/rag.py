@@ -1,95 +1,119 @@
-import os
-import sys
+import time
 import yaml
 import logging
-import pytz
-import datetime
 from django.conf import settings
-from langchain_groq import ChatGroq
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from functools import lru_cache
 from langchain_core.prompts import ChatPromptTemplate
 from .models import ChatMessage
-from langchain_chroma import Chroma
-from .utils import embedding_model
-
-# Setup Logging
-IST = pytz.timezone('Asia/Kolkata')
-LOG_FILE = f"{datetime.datetime.now(IST).strftime('%m_%d_%Y_%H_%M_%S')}.log"
-logs_path = os.path.join(settings.BASE_DIR, "logs")
-os.makedirs(logs_path, exist_ok=True)
-LOG_FILE_PATH = os.path.join(logs_path, LOG_FILE)
-
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE_PATH),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
-
-def get_retriever(collection_name):
+from .utils import get_vectorstore, normalize_question
+from .summaries import get_precomputed_answer
+from .rerank import RerankingRetriever
+from . import metrics
+from .admission import AdmissionRejected, llm_admission
+from .accounting import check_chat_quota, record
+from .singleflight import SingleFlight
+from .llm import answer_question
+
+logger = logging.getLogger(__name__)
+retrieval_logger = logging.getLogger("chat_with_document.retrieval")
+
+# In-flight answers keyed by (collection_name, normalized question)
+question_flights = SingleFlight("rag")
+
+
+def get_retriever(collection_name, embedding_model_name=None):
     try:
-        vectorstore = Chroma(
-            persist_directory="./chat_with_pdf",
-            collection_name=collection_name,
-            embedding_function=embedding_model
-        )
-        retriever = vectorstore.as_retriever(
-            search_type="mmr", search_kwargs={"k": 7}
-        )
-        logging.info(f"Retriever initialized for collection: {collection_name}")
+        vectorstore = get_vectorstore(collection_name, embedding_model_name)
+        if settings.RERANK_ENABLED:
+            # Over-fetch the top candidates by similarity; the cross-encoder picks the ones that go
+            # into the prompt. No MMR here: it would drop relevant chunks before the reranker sees them.
+            retriever = RerankingRetriever(base_retriever=vectorstore.as_retriever(
+                search_type="similarity", search_kwargs={"k": settings.RERANK_CANDIDATES}
+            ))
+        else:
+            retriever = vectorstore.as_retriever(
+                search_type="mmr", search_kwargs={"k": 7}
+            )
+        retrieval_logger.debug(f"Retriever initialized for collection: {collection_name}")
         return retriever
     except Exception as e:
-        logging.error(f"ChromaDB Retrieval Error: {e}")
+        logger.error(f"ChromaDB Retrieval Error: {e}")
         return None
 
 
-def get_rag_chain(retriever):
+@lru_cache(maxsize=1)
+def get_prompt():
     """
-    Create the RAG-based response generation chain.
+    Build the question-answering prompt from system_prompt.yaml (loaded once per process).
     """
-    logging.info("Creating conversational RAG chain")
-    llm = ChatGroq(model="llama-3.3-70b-versatile")
     with open("./system_prompt.yaml", "r") as file:
         system_prompt = yaml.safe_load(file)
-    prompt = ChatPromptTemplate.from_messages([
+    return ChatPromptTemplate.from_messages([
         ("system", system_prompt),
         ("human", "{input}"),
     ])
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
-    rag_chain = create_retrieval_chain(retriever, question_answer_chain)
-    logging.info("Conversational RAG chain created successfully")
-    return rag_chain
 
 
-logger = logging.getLogger(__name__)
+class RAGError(Exception):
+    """A failure whose message is shown to the user as the bot response."""
 
 
-def process_user_question(question, collection_name, chat_session=None):
-    try:
-        retriever = get_retriever(collection_name)
+def generate_answer(question, collection_name, user_id=None, embedding_model_name=None, document_id=None):
+    """
+    Runs retrieval and the LLM for one question and returns the formatted answer.
+    """
+    retriever = get_retriever(collection_name, embedding_model_name)
+
+    if not retriever:
+        raise RAGError("Error: Could not retrieve document embeddings.")
+
+    started = time.perf_counter()
+    documents = retriever.invoke(question)
+    # Size of the stuffed context, to weigh rerank cost against LLM-side savings
+    metrics.observe("rag.context_documents", len(documents))
+    metrics.observe("rag.context_chars", sum(len(doc.page_content) for doc in documents))
 
-        if not retriever:
-            return "Error: Could not retrieve document embeddings."
+    # Generate response. answer_question takes a global admission slot per LLM request; per-user
+    # limits were checked by each caller before it joined this (shared) flight.
+    answer, path, tokens = answer_question(get_prompt(), question, documents)
+    # Coalesced callers share this call, so its tokens are billed to the user who made it
+    record(user_id, document_id, llm_calls=1, **tokens)
+    metrics.observe("rag.latency_seconds", time.perf_counter() - started)
+    logger.info(f"Answer for collection {collection_name} served by: {path}")
 
-        logger.info(f"Retriever initialized for collection: {collection_name}")
-        logger.info("Creating conversational RAG chain")
+    if not answer:
+        logger.error("RAG Model failed to return a response.")
+        raise RAGError("Error: No response from RAG model.")
 
-        # Generate response
-        rag_chain = get_rag_chain(retriever)
-        response = rag_chain.invoke({"input": question})
+    return answer.replace('\n', '<br>')  # Ensure the response is properly formatted (e.g., HTML or Markdown)
 
-        if not response or "answer" not in response:
-            logging.error("RAG Model failed to return a response.")
-            return "Error: No response from RAG model."
 
-        formatted_response = response['answer'].replace('\n', '<br>')  # Ensure the response is properly formatted (e.g., HTML or Markdown)
+def process_user_question(
+    question, collection_name, chat_session=None, user_id=None, embedding_model_name=None, document_id=None
+):
+    """
+    Answers a question about a document. Raises AdmissionRejected when the LLM is
+    overloaded or the user is over their rate limit or token quota.
+    """
+    try:
+        # "Summarize this document" style questions are answered from the precomputed summary
+        formatted_response = get_precomputed_answer(question, collection_name)
+        if formatted_response:
+            logger.info(f"Answered from precomputed summary for collection: {collection_name}")
+        else:
+            # Per-user limits first, so a follower never inherits another user's rejection
+            check_chat_quota(user_id)
+            llm_admission.take_token(user_id)
+            # Concurrent identical questions about the same document share one retrieval + LLM call
+            key = (collection_name, normalize_question(question))
+            try:
+                formatted_response = question_flights.do(
+                    key, lambda: generate_answer(question, collection_name, user_id, embedding_model_name, document_id)
+                )
+            except AdmissionRejected:
+                # Only "busy" can come out of the flight, and that is not the user's fault
+                llm_admission.refund_token(user_id)
+                raise
 
         # Save the message if chat_session is provided
         if chat_session:
@@ -101,6 +125,10 @@ def process_user_question(question, collection_name, chat_session=None):
 
         return formatted_response
 
+    except AdmissionRejected:
+        raise
+    except RAGError as e:
+        return str(e)
     except Exception as e:
         logger.error(f"RAG Processing Error: {str(e)}", exc_info=True)
         return "I'm sorry, I encountered an error processing your question. Please try again."
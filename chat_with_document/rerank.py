@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from langchain_core.retrievers import BaseRetriever
+from . import metrics
+
+logger = logging.getLogger("chat_with_document.retrieval")
+
+
+# Optional rerank stage: the vector store over-fetches RERANK_CANDIDATES chunks, a small CPU
+# cross-encoder scores them against the question, and only the best ones (at most RERANK_TOP_N,
+# cut off at RERANK_SCORE_THRESHOLD) are stuffed into the prompt.
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_cross_encoder():
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import CrossEncoder
+            _model = CrossEncoder(settings.RERANK_MODEL, device="cpu")
+        return _model
+
+
+def rerank_documents(question, documents):
+    """
+    Returns the documents worth keeping, best first, each with its score in metadata["rerank_score"].
+    """
+    if not documents:
+        return documents
+
+    started = time.perf_counter()
+    scores = get_cross_encoder().predict(
+        [(question, doc.page_content) for doc in documents], batch_size=settings.RERANK_BATCH_SIZE
+    )
+    elapsed = time.perf_counter() - started
+
+    ranked = sorted(zip(documents, scores), key=lambda pair: pair[1], reverse=True)
+    kept = [
+        doc for i, (doc, score) in enumerate(ranked[:settings.RERANK_TOP_N])
+        if i < settings.RERANK_MIN_DOCS or score >= settings.RERANK_SCORE_THRESHOLD
+    ]
+    for doc, score in ranked:
+        doc.metadata["rerank_score"] = float(score)
+
+    metrics.observe("rerank.latency_seconds", elapsed)
+    metrics.observe("rerank.kept_documents", len(kept))
+    for _, score in ranked:
+        metrics.observe("rerank.score", float(score))
+    logger.debug(
+        f"Reranked {len(documents)} chunks in {elapsed * 1000:.0f} ms, kept {len(kept)}; "
+        f"scores max={ranked[0][1]:.2f} min={ranked[-1][1]:.2f}"
+    )
+    return kept
+
+
+class RerankingRetriever(BaseRetriever):
+    """Wraps a retriever and reranks what it returns with the cross-encoder."""
+
+    base_retriever: BaseRetriever
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        documents = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return rerank_documents(query, documents)
@@ -0,0 +1,66 @@
+import html
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F
+from .models import ChatMessage, chat_message_search_vector
+
+# Full-text search over a user's chat history.
+# Messages are matched on chat_message_search_vector(), the exact expression of the GIN index built by
+# migration 0009, so matching never scans the message table. Ranking recomputes the vector for the
+# matching rows only, and highlights are only computed for the rows of the requested page.
+SEARCH_CONFIG = "english"  # Must match the config of chat_message_search_vector()
+
+# ts_headline does not escape the text, so matches are marked with control characters,
+# the text is escaped, then the markers become <mark> tags.
+_START, _STOP = "\x02", "\x03"
+
+
+def _highlight(text):
+    text = html.escape(text.replace("<br>", "\n"))
+    return text.replace(_START, "<mark>").replace(_STOP, "</mark>").replace("\n", "<br>")
+
+
+def search_messages(user, query, page=1, page_size=None):
+    """
+    Returns one page of the user's chat messages matching `query` (web search syntax: "quoted phrases",
+    or, -exclusions), best matches first, and whether there is a next page.
+    """
+    page_size = page_size or settings.SEARCH_PAGE_SIZE
+    search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+
+    # Ids and ranks only; one extra row tells whether there is a next page without counting all matches
+    offset = (page - 1) * page_size
+    ranked = list(
+        ChatMessage.objects.annotate(search_vector=chat_message_search_vector())
+        .filter(session__user=user, session__document__deleted=False, search_vector=search_query)
+        .annotate(rank=SearchRank(F("search_vector"), search_query))
+        .order_by("-rank", "-timestamp")
+        .values_list("id", "rank")[offset:offset + page_size + 1]
+    )
+    has_next = len(ranked) > page_size
+    ranked = ranked[:page_size]
+
+    headline_options = {"config": SEARCH_CONFIG, "start_sel": _START, "stop_sel": _STOP}
+    messages = ChatMessage.objects.filter(id__in=[message_id for message_id, _ in ranked]).select_related(
+        "session__document"
+    ).annotate(
+        user_message_headline=SearchHeadline("user_message", search_query, **headline_options),
+        bot_response_headline=SearchHeadline("bot_response", search_query, **headline_options),
+    )
+    by_id = {message.id: message for message in messages}
+
+    results = []
+    for message_id, rank in ranked:
+        message = by_id.get(message_id)
+        if message is None:  # Deleted between the two queries
+            continue
+        results.append({
+            "message_id": str(message.id),
+            "session_id": str(message.session_id),
+            "document": message.session.document.file.name,
+            "timestamp": message.timestamp.isoformat(),
+            "rank": rank,
+            "user_message": _highlight(message.user_message_headline),
+            "bot_response": _highlight(message.bot_response_headline),
+        })
+    return results, has_next
@@ -0,0 +1,33 @@
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .bulk import start_recovery
+from .cache import invalidate_cached_user, invalidate_user_cache
+from .models import ChatSession, CustomUser, UploadDocument
+
+
+# Upload, status change and soft delete all go through UploadDocument.save().
+@receiver(post_save, sender=UploadDocument)
+@receiver(post_delete, sender=UploadDocument)
+def invalidate_documents_cache(sender, instance, **kwargs):
+    invalidate_user_cache(instance.user_id)
+
+
+@receiver(post_save, sender=ChatSession)
+@receiver(post_delete, sender=ChatSession)
+def invalidate_chat_session_cache(sender, instance, **kwargs):
+    invalidate_user_cache(instance.user_id)
+
+
+# Username, email, password (change or reset), is_active and last_login changes all save the user.
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_auth_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+# Bulk ingestion runs in a background thread of a web process; once this process serves requests,
+# it keeps its own batches claimed and re-queues the batches a stopped process left unfinished.
+@receiver(request_started)
+def start_bulk_recovery(sender, **kwargs):
+    start_recovery()
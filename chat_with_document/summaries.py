@@ -0,0 +1,145 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from langchain_groq import ChatGroq
+from .models import DocumentSummary, UploadDocument
+from .utils import load_pdf_pages, normalize_question
+
+logger = logging.getLogger(__name__)
+
+
+# Hierarchical (map-reduce) summaries built once per document at ingestion time,
+# so "summarize this document" style questions are answered without an LLM call.
+MAP_PROMPT = (
+    "Summarize the following part of a document in a few concise paragraphs. "
+    "Keep names, numbers and conclusions.\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive parts of one document. "
+    "Combine them into a single coherent summary of the whole document.\n\n{text}"
+)
+KEY_POINTS_PROMPT = (
+    "List the key points of the document summarized below as a short bulleted list, "
+    "one point per line starting with '- '.\n\n{text}"
+)
+QUESTIONS_PROMPT = (
+    "Based on the document summary below, write {count} questions a reader might ask about the document. "
+    "Write one question per line, with no numbering.\n\n{text}"
+)
+
+_executor = ThreadPoolExecutor(max_workers=settings.SUMMARY_WORKERS, thread_name_prefix="summary")
+
+_SUMMARY_RE = re.compile(
+    r"(please )?(can you |could you )?"
+    r"(summari[sz]e|give( me)?( a)? summary|(what is|what's) the summary|tl;?dr|(what is|what's) (this|the) (document|pdf|file) about)"
+    r"( of)?( (this|the|it))?( (document|pdf|file|paper))?( for me)?( please)?"
+)
+_KEY_POINTS_RE = re.compile(
+    r"(please )?((what are|list|give( me)?) )?(the )?(key|main) (points|takeaways|ideas)"
+    r"( (of|in) (this|the|it)( (document|pdf|file|paper))?)?( please)?"
+)
+
+
+def classify_summary_request(question):
+    """
+    Returns "summary" or "key_points" when the whole question asks for a document overview, else None.
+    """
+    normalized = normalize_question(question)
+    if _SUMMARY_RE.fullmatch(normalized):
+        return "summary"
+    if _KEY_POINTS_RE.fullmatch(normalized):
+        return "key_points"
+    return None
+
+
+def get_precomputed_answer(question, collection_name):
+    """
+    Answers summary-style questions from the stored DocumentSummary; None if not applicable or not ready.
+    """
+    kind = classify_summary_request(question)
+    if kind is None:
+        return None
+    summary = DocumentSummary.objects.filter(
+        document__collection_name=collection_name, status="completed"
+    ).first()
+    if summary is None:
+        return None
+    answer = summary.summary if kind == "summary" else summary.key_points
+    return answer or None
+
+
+def _invoke(llm, template, **kwargs):
+    return llm.invoke(template.format(**kwargs)).content.strip()
+
+
+def _batches(texts, max_chars, min_items=1):
+    """
+    Groups consecutive texts into batches of about `max_chars` characters and at least `min_items` texts.
+    """
+    batch, size = [], 0
+    for text in texts:
+        if len(batch) >= min_items and size + len(text) > max_chars:
+            yield "\n\n".join(batch)
+            batch, size = [], 0
+        batch.append(text[:max_chars])
+        size += len(text)
+    if batch:
+        yield "\n\n".join(batch)
+
+
+def build_document_summary(document):
+    """
+    Map-reduce summary over all pages, then key points and suggested questions from the summary.
+    """
+    llm = ChatGroq(model=settings.SUMMARY_MODEL)
+    max_chars = settings.SUMMARY_MAP_CHARS
+
+    pages = [page.page_content for page in load_pdf_pages(document.file.path, document.content_hash or None) if page.page_content.strip()]
+    if not pages:
+        raise ValueError("No text extracted from PDF.")
+
+    # Map: summarize consecutive page ranges
+    summaries = [_invoke(llm, MAP_PROMPT, text=batch) for batch in _batches(pages, max_chars)]
+    # Reduce: merge summaries level by level until a single one remains.
+    # At least two per batch, so every level shrinks even when the summaries are long.
+    while len(summaries) > 1:
+        summaries = [_invoke(llm, REDUCE_PROMPT, text=batch) for batch in _batches(summaries, max_chars, min_items=2)]
+    summary = summaries[0]
+
+    key_points = _invoke(llm, KEY_POINTS_PROMPT, text=summary)
+    questions = _invoke(llm, QUESTIONS_PROMPT, text=summary, count=settings.SUMMARY_QUESTION_COUNT)
+    suggested_questions = [
+        line.strip(" -*\t") for line in questions.splitlines() if line.strip(" -*\t").endswith("?")
+    ][:settings.SUMMARY_QUESTION_COUNT]
+
+    return {
+        "summary": summary.replace('\n', '<br>'),
+        "key_points": key_points.replace('\n', '<br>'),
+        "suggested_questions": suggested_questions,
+    }
+
+
+def _summarize_in_background(document_id):
+    close_old_connections()
+    try:
+        document = UploadDocument.objects.get(id=document_id)
+        try:
+            result = build_document_summary(document)
+            DocumentSummary.objects.update_or_create(document=document, defaults=dict(result, status="completed"))
+            logger.info(f"Summary stored for document {document_id}")
+        except Exception as e:
+            DocumentSummary.objects.update_or_create(document=document, defaults={"status": "failed"})
+            logger.error(f"Error summarizing document {document_id}: {e}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def schedule_document_summary(document):
+    """
+    Queues summary generation for a processed document once the current transaction commits.
+    """
+    DocumentSummary.objects.update_or_create(document=document, defaults={"status": "pending"})
+    document_id = document.id
+    transaction.on_commit(lambda: _executor.submit(_summarize_in_background, document_id))
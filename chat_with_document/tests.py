@@ -1,3 +1,1191 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import Mock, patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import numpy as np
+
+from . import accounting, bulk, llm, metrics
+from .logging_utils import SampledDebugFilter, queued_handler
+from .management.commands import sweep_hnsw
+from .management.commands.migrate_embeddings import shadow_collection_name
+from .mmap_store import MmapVectorStore
+from .rag import get_retriever, process_user_question
+from .admission import AdmissionController, AdmissionRejected
+from .cache import get_latest_chat_session, get_user_documents
+from .chunking import get_text_splitter
+from .models import (
+    ChatMessage, ChatSession, ChunkedUpload, CustomUser, RetiredCollection, UploadBatch, UploadDocument, UsageRollup,
+    chat_message_search_vector,
+)
+from .singleflight import SingleFlight
+from .summaries import classify_summary_request
+from .uploads import expire_abandoned_uploads, partial_path
+from .utils import drop_collection, get_vectorstore, hnsw_params, load_pdf_pages, page_hash, reindex_changed_pages
+from .vectordb import get_chroma_client
+
+
+# Maximum number of queries each view may run for a logged-in user.
+# The session is read from the cache (cached_db sessions) and the user from the auth user
+# cache; setUp clears the cache, so each budget includes 1 query for a cold user row.
+QUERY_BUDGETS = {
+    "index": 3,
+    "list_documents": 2,
+    "start_chat": 4,
+    "chat_with_document": 3,
+    "chat_interface": 2,
+    "chat_history": 3,
+    "search_chat_history": 3,
+}
+
+
+class QueryBudgetTests(TestCase):
+    """Regression tests that fail when a view goes over its query budget."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username="reader", email="reader@example.com", password="secret-pass-123"
+        )
+        cls.documents = [
+            UploadDocument.objects.create(user=cls.user, file=f"documents/doc_{i}.pdf", status="completed")
+            for i in range(5)
+        ]
+        cls.session = ChatSession.objects.create(user=cls.user, document=cls.documents[0])
+        for i in range(5):
+            ChatMessage.objects.create(session=cls.session, user_message=f"question {i}", bot_response=f"answer {i}")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertWithinBudget(self, view_name, method, url, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, **kwargs)
+        budget = QUERY_BUDGETS[view_name]
+        self.assertLessEqual(
+            len(ctx.captured_queries), budget,
+            f"{view_name} ran {len(ctx.captured_queries)} queries (budget {budget}):\n"
+            + "\n".join(q["sql"] for q in ctx.captured_queries),
+        )
+        return response
+
+    def test_index(self):
+        response = self.assertWithinBudget("index", "get", reverse("index"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_documents(self):
+        response = self.assertWithinBudget("list_documents", "get", reverse("list_documents"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_start_chat(self):
+        url = reverse("start_chat", kwargs={"document_id": self.documents[0].id})
+        response = self.assertWithinBudget("start_chat", "get", url)
+        self.assertEqual(response.json()["session_id"], str(self.session.id))
+
+    @patch("chat_with_document.views.process_user_question", return_value="answer")
+    def test_chat_with_document(self, mock_process):
+        url = reverse("chat_with_document", kwargs={"session_id": self.session.id})
+        response = self.assertWithinBudget(
+            "chat_with_document", "post", url,
+            data=json.dumps({"message": "hello"}), content_type="application/json",
+        )
+        self.assertEqual(response.json()["bot_response"], "answer")
+
+    def test_chat_interface(self):
+        url = reverse("chat_interface", kwargs={"session_id": self.session.id})
+        response = self.assertWithinBudget("chat_interface", "get", url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_chat_history(self):
+        url = reverse("chat_history", kwargs={"session_id": self.session.id})
+        response = self.assertWithinBudget("chat_history", "get", url)
+        self.assertEqual(len(response.json()["messages"]), 10)
+
+    def test_search_chat_history(self):
+        url = reverse("search_chat_history")
+        response = self.assertWithinBudget("search_chat_history", "get", url, data={"q": "questions"})
+        self.assertEqual(len(response.json()["results"]), 5)
+
+
+class ChatSearchTests(TestCase):
+    """Full-text search over chat history: ranking, highlighting, pagination and per-user scoping."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, other = [
+            CustomUser.objects.create_user(username=name, email=f"{name}@example.com", password="secret-pass-123")
+            for name in ("searcher", "other")
+        ]
+        for user in (cls.user, other):
+            document = UploadDocument.objects.create(user=user, file="documents/report.pdf", status="completed")
+            session = ChatSession.objects.create(user=user, document=document)
+            ChatMessage.objects.create(session=session, user_message="What is the budget?", bot_response="The budget is < $5 & final.")
+            ChatMessage.objects.create(session=session, user_message="Who wrote it?", bot_response="The budget office wrote it.")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, **params):
+        return self.client.get(reverse("search_chat_history"), params).json()
+
+    def test_results_are_ranked_highlighted_and_scoped_to_the_user(self):
+        results = self.search(q="budget")["results"]
+        self.assertEqual(len(results), 2)
+        # A match in the question outranks a match only in the answer
+        self.assertIn("What is the <mark>budget</mark>", results[0]["user_message"])
+        self.assertIn("&lt; $5 &amp;", results[0]["bot_response"])
+
+    @override_settings(SEARCH_PAGE_SIZE=1)
+    def test_pagination(self):
+        first, second = self.search(q="budget", page=1), self.search(q="budget", page=2)
+        self.assertEqual((len(first["results"]), first["has_next"]), (1, True))
+        self.assertEqual((len(second["results"]), second["has_next"]), (1, False))
+        self.assertNotEqual(first["results"][0]["message_id"], second["results"][0]["message_id"])
+
+    def test_matching_uses_the_expression_index(self):
+        query = SearchQuery("budget", search_type="websearch", config="english")
+        matches = ChatMessage.objects.annotate(search_vector=chat_message_search_vector()).filter(search_vector=query)
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        self.assertIn("chatmessage_search_gin_idx", matches.explain())
+
+
+class AuthBackendTests(TestCase):
+    """Email login through the single backend, and the per-request user served from the cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username="auth", email="auth@example.com", password="secret-pass-123"
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(url)
+        return [q["sql"] for q in ctx.captured_queries if CustomUser._meta.db_table in q["sql"]]
+
+    def test_login_by_email(self):
+        self.assertFalse(self.client.login(username="auth@example.com", password="wrong"))
+        self.assertTrue(self.client.login(username="auth@example.com", password="secret-pass-123"))
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=900)  # As with a shared cache backend
+    def test_user_is_cached_until_it_changes(self):
+        self.client.force_login(self.user)
+        url = reverse("list_documents")
+        self.user_queries(url)
+        self.assertEqual(self.user_queries(url), [])
+
+        self.client.post(reverse("update-username"), {"new_username": "renamed"})
+        response = self.client.get(reverse("update-username"))
+        self.assertEqual(response.context["current_username"], "renamed")
+
+    def test_process_local_cache_does_not_cache_users(self):
+        self.assertFalse(settings.CACHE_IS_SHARED)
+        self.assertEqual(settings.AUTH_USER_CACHE_TIMEOUT, 0)
+        self.client.force_login(self.user)
+        self.client.get(reverse("list_documents"))
+        # Deactivated without a signal reaching this process, e.g. by another worker
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse("list_documents")).status_code, 302)
+
+
+@override_settings(AUTH_USER_CACHE_TIMEOUT=900)
+class IndexCacheTests(TestCase):
+    """The index page is served from the per-user cache until a model signal invalidates it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username="cached", email="cached@example.com", password="secret-pass-123"
+        )
+        cls.document = UploadDocument.objects.create(user=cls.user, file="documents/first.pdf", status="completed")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_warm_index_runs_no_queries(self):
+        self.client.get(reverse("index"))
+        # Session, user and document list all come from the cache.
+        with self.assertNumQueries(0):
+            self.client.get(reverse("index"))
+
+    def test_upload_invalidates_document_list(self):
+        self.assertEqual(get_user_documents(self.user), [self.document])
+        new_document = UploadDocument.objects.create(user=self.user, file="documents/second.pdf")
+        self.assertEqual(get_user_documents(self.user), [new_document, self.document])
+
+    def test_soft_delete_invalidates_document_list(self):
+        self.assertEqual(get_user_documents(self.user), [self.document])
+        self.document.delete()
+        self.assertEqual(get_user_documents(self.user), [])
+
+    def test_new_session_invalidates_latest_session(self):
+        self.assertIsNone(get_latest_chat_session(self.user))
+        session = ChatSession.objects.create(user=self.user, document=self.document)
+        self.assertEqual(get_latest_chat_session(self.user), session)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), CHUNKED_UPLOAD_CHUNK_SIZE=4, CHROMA_MODE="embedded", CHROMA_DB_PATH=tempfile.mkdtemp()
+)
+class ChunkedUploadTests(TestCase):
+    """Resumable chunked upload: offsets, resume query and finalize."""
+
+    content = b"%PDF-1.4 test"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username="uploader", email="uploader@example.com", password="secret-pass-123"
+        )
+
+    def setUp(self):
+        self.addCleanup(accounting.flush)  # Write the ingestion usage while the test database exists
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("chunked_upload_start"),
+            data=json.dumps({"filename": "report.pdf", "size": len(self.content)}),
+            content_type="application/json",
+        )
+        self.upload_id = response.json()["upload_id"]
+        self.url = reverse("chunked_upload", kwargs={"upload_id": self.upload_id})
+
+    def put_chunk(self, offset):
+        return self.client.put(
+            self.url, data=self.content[offset:offset + 4],
+            content_type="application/octet-stream", HTTP_X_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_wrong_offset_returns_expected_offset(self):
+        self.put_chunk(0)
+        response = self.put_chunk(8)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["offset"], 4)
+
+    def test_resume_query_reports_offset(self):
+        self.put_chunk(0)
+        self.put_chunk(4)
+        self.assertEqual(self.client.get(self.url).json()["offset"], 8)
+
+    @patch("chat_with_document.views.store_embeddings_in_chroma", return_value=[])
+    def test_finalize_creates_document_with_hash(self, mock_store):
+        finalize_url = reverse("chunked_upload_finalize", kwargs={"upload_id": self.upload_id})
+        self.assertEqual(self.client.post(finalize_url).status_code, 409)
+
+        for offset in range(0, len(self.content), 4):
+            self.assertEqual(self.put_chunk(offset).status_code, 200)
+        response = self.client.post(finalize_url)
+
+        document = UploadDocument.objects.get(id=response.json()["document"]["id"])
+        self.assertEqual(document.content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(document.status, "completed")
+        with open(document.file.path, "rb") as f:
+            self.assertEqual(f.read(), self.content)
+        mock_store.assert_called_once_with(
+            document.file.path, document.collection_name, document.chunking_strategy, document.embedding_model_name,
+            document.content_hash,
+        )
+
+    def put_all_chunks(self):
+        for offset in range(0, len(self.content), 4):
+            self.put_chunk(offset)
+        return reverse("chunked_upload_finalize", kwargs={"upload_id": self.upload_id})
+
+    @patch("chat_with_document.views.drop_collection")
+    @patch("chat_with_document.views.store_embeddings_in_chroma", return_value=[])
+    def test_retried_finalize_does_not_ingest_again(self, mock_store, mock_drop):
+        finalize_url = self.put_all_chunks()
+        first, retry = self.client.post(finalize_url).json(), self.client.post(finalize_url).json()
+        self.assertEqual(first["document"]["id"], retry["document"]["id"])
+        self.assertEqual(retry["status"], "completed")
+        mock_store.assert_called_once()
+        mock_drop.assert_not_called()
+
+    @patch("chat_with_document.views.drop_collection")
+    @patch("chat_with_document.views.store_embeddings_in_chroma", return_value=[])
+    def test_interrupted_ingestion_resumes_from_an_empty_collection(self, mock_store, mock_drop):
+        finalize_url = self.put_all_chunks()
+        with patch("chat_with_document.views.process_document"):  # The worker died while ingesting
+            document_id = self.client.post(finalize_url).json()["document"]["id"]
+        self.assertEqual(self.client.post(finalize_url).json()["status"], "processing")  # Maybe still running
+        mock_store.assert_not_called()
+
+        ChunkedUpload.objects.filter(id=self.upload_id).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.client.post(finalize_url).json()["status"], "completed")
+        mock_drop.assert_called_once_with(UploadDocument.objects.get(id=document_id).collection_name)
+        mock_store.assert_called_once()
+
+    def test_abandoned_upload_expires_with_its_partial_file(self):
+        self.put_chunk(0)
+        upload = ChunkedUpload.objects.get(id=self.upload_id)
+        expire_abandoned_uploads()
+        self.assertTrue(os.path.exists(partial_path(upload)))
+
+        ChunkedUpload.objects.filter(id=self.upload_id).update(updated_at=timezone.now() - timedelta(days=2))
+        expire_abandoned_uploads()
+        self.assertFalse(ChunkedUpload.objects.filter(id=self.upload_id).exists())
+        self.assertFalse(os.path.exists(partial_path(upload)))
+
+    def test_start_request_must_be_a_json_object(self):
+        response = self.client.post(reverse("chunked_upload_start"), data="[]", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+def _pages(*texts):
+    return [Document(page_content=text, metadata={"page": i, "page_hash": page_hash(text)}) for i, text in enumerate(texts)]
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), VECTOR_STORE_BACKEND="chroma", CHROMA_MODE="embedded", CHROMA_DB_PATH=tempfile.mkdtemp()
+)
+class ReindexTests(TestCase):
+    """Replacing a document re-embeds only changed pages and never loses chunks on failure."""
+
+    def setUp(self):
+        # One chunk per page, embedded with a fake model
+        for target, kwargs in [
+            ("chat_with_document.utils.get_embedding_model", {"return_value": DeterministicFakeEmbedding(size=16)}),
+            ("chat_with_document.utils.split_pages", {"side_effect": lambda pages, *args: [
+                Document(page_content=page.page_content, metadata=dict(page.metadata)) for page in pages
+            ]}),
+        ]:
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.collection_name = f"test_reindex_{self._testMethodName}"
+        self.addCleanup(drop_collection, self.collection_name)
+        self.addCleanup(accounting.flush)
+
+    def reindex(self, old_page_hashes, *texts):
+        with patch("chat_with_document.utils.load_pdf_pages", return_value=_pages(*texts)):
+            return reindex_changed_pages("unused.pdf", self.collection_name, old_page_hashes)
+
+    def indexed(self):
+        data = get_vectorstore(self.collection_name).get(include=["documents", "metadatas"])
+        return sorted((metadata["page"], text) for text, metadata in zip(data["documents"], data["metadatas"]))
+
+    def test_changed_page_is_re_embedded(self):
+        hashes, _, _ = self.reindex([], "alpha", "beta", "gamma")
+        hashes, pages_embedded, _ = self.reindex(hashes, "alpha", "BETA", "gamma")
+        self.assertEqual(pages_embedded, 1)
+        self.assertEqual(self.indexed(), [(0, "alpha"), (1, "BETA"), (2, "gamma")])
+
+    def test_removed_page_is_deleted_and_later_pages_move_up(self):
+        hashes, _, _ = self.reindex([], "alpha", "beta", "gamma")
+        _, pages_embedded, _ = self.reindex(hashes, "alpha", "gamma")
+        self.assertEqual(pages_embedded, 0)
+        self.assertEqual(self.indexed(), [(0, "alpha"), (1, "gamma")])
+
+    def test_moved_pages_keep_their_vectors(self):
+        hashes, _, _ = self.reindex([], "alpha", "beta")
+        with patch.object(Chroma, "add_documents") as add_documents:
+            _, pages_embedded, _ = self.reindex(hashes, "beta", "alpha")
+        add_documents.assert_not_called()
+        self.assertEqual(pages_embedded, 0)
+        self.assertEqual(self.indexed(), [(0, "beta"), (1, "alpha")])
+
+    @patch("chat_with_document.views.schedule_document_summary")
+    def test_failure_part_way_keeps_the_old_file_and_forces_a_rebuild(self, mock_summary):
+        user = CustomUser.objects.create_user(username="reviser", email="reviser@example.com", password="secret-pass-123")
+        self.client.force_login(user)
+        document = UploadDocument.objects.create(
+            user=user, file=SimpleUploadedFile("v1.pdf", b"%PDF-1.4 v1"), collection_name=self.collection_name,
+            status="completed",
+        )
+        document.page_hashes, _, _ = self.reindex([], "alpha", "beta")
+        document.save()
+        url = reverse("replace_document", kwargs={"doc_id": document.id})
+
+        # New chunks are added, then deleting the stale ones fails
+        with patch("chat_with_document.utils.load_pdf_pages", return_value=_pages("alpha", "BETA")), \
+                patch.object(Chroma, "delete", side_effect=RuntimeError("connection lost")):
+            response = self.client.post(url, {"file": SimpleUploadedFile("v2.pdf", b"%PDF-1.4 v2")})
+        self.assertFalse(response.json()["success"])
+        document.refresh_from_db()
+        self.assertEqual((document.status, document.page_hashes), ("failed", []))
+        self.assertTrue(document.file.name.endswith("v1.pdf"))
+        self.assertIn((1, "beta"), self.indexed())  # Nothing was lost
+
+        with patch("chat_with_document.utils.load_pdf_pages", return_value=_pages("alpha", "BETA")):
+            response = self.client.post(url, {"file": SimpleUploadedFile("v2.pdf", b"%PDF-1.4 v2")})
+        self.assertTrue(response.json()["success"])
+        self.assertEqual(self.indexed(), [(0, "alpha"), (1, "BETA")])
+
+    def test_unreadable_revision_keeps_the_old_one_in_service(self):
+        user = CustomUser.objects.create_user(username="reviser", email="reviser@example.com", password="secret-pass-123")
+        self.client.force_login(user)
+        document = UploadDocument.objects.create(
+            user=user, file=SimpleUploadedFile("v1.pdf", b"%PDF-1.4 v1"), collection_name=self.collection_name,
+            status="completed",
+        )
+        document.page_hashes, _, _ = self.reindex([], "alpha", "beta")
+        document.save()
+
+        with patch("chat_with_document.utils.load_pdf_pages", side_effect=ValueError("not a PDF")):
+            response = self.client.post(
+                reverse("replace_document", kwargs={"doc_id": document.id}),
+                {"file": SimpleUploadedFile("v2.pdf", b"%PDF-1.4 v2")},
+            )
+        self.assertFalse(response.json()["success"])
+        document.refresh_from_db()
+        self.assertEqual(document.status, "completed")
+        self.assertTrue(document.file.name.endswith("v1.pdf"))
+        self.assertEqual(self.indexed(), [(0, "alpha"), (1, "beta")])
+        response = self.client.post(reverse("start_chat", kwargs={"document_id": document.id}))
+        self.assertTrue(response.json()["success"])
+
+
+class ExtractedTextCacheTests(SimpleTestCase):
+    """Extracted text is cached next to the PDF, keyed by the file's contents and the extractor version."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(directory, "report.pdf")
+        self.write(b"%PDF-1.4 v1")
+        patcher = patch("chat_with_document.utils.PyPDFLoader")
+        self.loader = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loader.return_value.load.side_effect = lambda: [Document(page_content="alpha", metadata={"page": 0})]
+
+    def write(self, content):
+        with open(self.pdf_path, "wb") as f:
+            f.write(content)
+
+    def test_cache_hit_skips_the_pdf_parser(self):
+        load_pdf_pages(self.pdf_path)
+        pages = load_pdf_pages(self.pdf_path)
+        self.loader.assert_called_once()
+        self.assertEqual([(page.page_content, page.metadata["page_hash"]) for page in pages], [("alpha", page_hash("alpha"))])
+
+    def test_changed_contents_miss_the_cache(self):
+        load_pdf_pages(self.pdf_path)
+        self.write(b"%PDF-1.4 v2")
+        load_pdf_pages(self.pdf_path)
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_new_extractor_version_misses_the_cache(self):
+        load_pdf_pages(self.pdf_path)
+        with patch("chat_with_document.utils.PDF_EXTRACTOR_VERSION", "pypdf-0.0.0-1"):
+            load_pdf_pages(self.pdf_path)
+        self.assertEqual(self.loader.call_count, 2)
+
+
+class MigrateEmbeddingsTests(TestCase):
+    """migrate_embeddings fills a shadow collection, then switches the document over and drops the old one."""
+
+    command = "chat_with_document.management.commands.migrate_embeddings"
+
+    def setUp(self):
+        user = CustomUser.objects.create_user(username="migrator", email="migrator@example.com", password="secret-pass-123")
+        self.document = UploadDocument.objects.create(
+            user=user, file="documents/report.pdf", status="completed", content_hash="v1",
+            collection_name="collection_old", embedding_model_name="old-model",
+        )
+        self.shadow = shadow_collection_name(self.document, "new-model")
+        self.vectorstore = Mock()
+        for target, kwargs in [
+            ("load_pdf_pages", {"return_value": _pages("alpha", "beta", "gamma")}),
+            ("split_pages", {"side_effect": lambda pages, *args: pages}),
+            ("get_vectorstore", {"return_value": self.vectorstore}),
+        ]:
+            patcher = patch(f"{self.command}.{target}", **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch(f"{self.command}.drop_collection")
+        self.drop_collection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def migrate(self):
+        call_command(
+            "migrate_embeddings", model="new-model", batch_size=2, grace_seconds=0, stdout=io.StringIO(), stderr=io.StringIO()
+        )
+
+    def test_document_is_copied_to_a_shadow_collection_and_switched_over(self):
+        self.migrate()
+        self.assertEqual(
+            [[doc.page_content for doc in c.args[0]] for c in self.vectorstore.add_documents.call_args_list],
+            [["alpha", "beta"], ["gamma"]],
+        )
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.collection_name, self.document.embedding_model_name), (self.shadow, "new-model"))
+        # Leftovers of an earlier run are cleared first; the old collection goes once nothing reads it
+        self.assertEqual([c.args[0] for c in self.drop_collection.call_args_list], [self.shadow, "collection_old"])
+
+        self.migrate()  # Already on the target model
+        self.assertEqual(self.vectorstore.add_documents.call_count, 2)
+
+    def test_document_replaced_during_the_copy_keeps_its_collection(self):
+        def replace_document(splits):
+            UploadDocument.objects.filter(id=self.document.id).update(content_hash="v2")
+
+        self.vectorstore.add_documents.side_effect = replace_document
+        self.migrate()
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.collection_name, self.document.embedding_model_name), ("collection_old", "old-model"))
+        self.assertEqual([c.args[0] for c in self.drop_collection.call_args_list], [self.shadow, self.shadow])
+
+    def test_failed_copy_keeps_serving_the_old_collection(self):
+        self.vectorstore.add_documents.side_effect = RuntimeError("embedding service down")
+        self.migrate()
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.collection_name, "collection_old")
+        self.assertNotIn("collection_old", [c.args[0] for c in self.drop_collection.call_args_list])
+
+
+    def test_old_collection_left_by_an_interrupted_run_is_dropped_on_the_next(self):
+        with patch(f"{self.command}.Command.drop_retired", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.migrate()
+        self.assertNotIn("collection_old", [c.args[0] for c in self.drop_collection.call_args_list])
+        self.assertTrue(RetiredCollection.objects.filter(name="collection_old").exists())
+
+        self.migrate()
+        self.assertIn("collection_old", [c.args[0] for c in self.drop_collection.call_args_list])
+        self.assertFalse(RetiredCollection.objects.exists())
+
+    def test_old_collection_is_not_dropped_before_its_grace_period(self):
+        with patch(f"{self.command}.time.sleep") as sleep:
+            call_command("migrate_embeddings", model="new-model", grace_seconds=60, stdout=io.StringIO())
+        self.assertAlmostEqual(sleep.call_args.args[0], 60, delta=5)
+        self.assertEqual([c.args[0] for c in self.drop_collection.call_args_list], [self.shadow, "collection_old"])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BulkUploadTests(TestCase):
+    """Bulk upload: PDFs and ZIP contents become one batch of documents, created atomically."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username="bulk", email="bulk@example.com", password="secret-pass-123"
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_pdfs_and_zip_contents_create_one_batch(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("reports/b.pdf", b"%PDF-1.4 b")
+            z.writestr("__MACOSX/reports/._b.pdf", b"junk")
+            z.writestr("notes.txt", b"not a pdf")
+        files = [
+            SimpleUploadedFile("a.pdf", b"%PDF-1.4 a"),
+            SimpleUploadedFile("docs.zip", archive.getvalue()),
+        ]
+        response = self.client.post(reverse("bulk_upload"), {"files": files})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["documents"], 2)
+
+        progress = self.client.get(response.json()["progress_url"]).json()
+        self.assertEqual((progress["processing"], progress["done"]), (2, False))
+        self.assertEqual(UploadDocument.objects.filter(batch_id=progress["batch_id"]).count(), 2)
+
+    def test_unsupported_file_rejects_the_whole_upload(self):
+        files = [SimpleUploadedFile("a.pdf", b"%PDF-1.4 a"), SimpleUploadedFile("notes.txt", b"text")]
+        response = self.client.post(reverse("bulk_upload"), {"files": files})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadDocument.objects.exists())
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_corrupt_zip_member_rejects_the_whole_upload(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("a.pdf", b"%PDF-1.4 a")
+            z.writestr("b.pdf", b"%PDF-1.4 b")
+        content = archive.getvalue().replace(b"%PDF-1.4 b", b"%PDF-1.4 X")  # Fails its CRC check
+        response = self.client.post(reverse("bulk_upload"), {"files": [SimpleUploadedFile("docs.zip", content)]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("b.pdf is corrupt", response.json()["error"])
+        self.assertFalse(UploadDocument.objects.exists())
+        self.assertFalse(os.listdir(os.path.join(settings.MEDIA_ROOT, "documents")))
+
+    def processing_document(self):
+        batch = UploadBatch.objects.create(user=self.user, owner=uuid.uuid4())
+        return UploadDocument.objects.create(user=self.user, batch=batch, file="documents/a.pdf", status="processing")
+
+    @override_settings(BULK_EMBED_BATCH_SIZE=2)
+    @patch("chat_with_document.bulk.drop_collection")
+    @patch("chat_with_document.bulk.get_vectorstore")
+    @patch("chat_with_document.bulk.get_embedding_model", return_value=DeterministicFakeEmbedding(size=8))
+    def test_document_failing_part_way_drops_its_stored_chunks(self, mock_model, mock_vectorstore, mock_drop):
+        self.addCleanup(accounting.flush)
+        document = self.processing_document()
+        splits = _pages("alpha", "beta", "gamma")
+        with patch("chat_with_document.bulk._prepare", return_value=("hash", [], splits, 0)), \
+                patch("chat_with_document.bulk.add_embedded_chunks", side_effect=[None, RuntimeError("disk full")]):
+            bulk.ingest_batch(document.batch_id, document.batch.owner)
+        document.refresh_from_db()
+        self.assertEqual(document.status, "failed")
+        mock_drop.assert_called_once_with(document.collection_name)
+
+    @override_settings(BULK_STALE_SECONDS=60)
+    @patch("chat_with_document.bulk.drop_collection")
+    @patch("chat_with_document.bulk._executor")
+    def test_interrupted_batch_is_requeued_once(self, mock_executor, mock_drop):
+        document = self.processing_document()
+        self.assertEqual(bulk.recover_interrupted_batches(), [])  # Still being worked on
+
+        UploadBatch.objects.filter(id=document.batch_id).update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.addCleanup(bulk._owned.clear)
+        self.assertEqual(bulk.recover_interrupted_batches(), [document.batch_id])
+        mock_drop.assert_called_once_with(document.collection_name)  # Chunks of the interrupted run
+        owner = UploadBatch.objects.get(id=document.batch_id).owner
+        self.assertNotEqual(owner, document.batch.owner)
+        mock_executor.submit.assert_called_once_with(bulk._ingest_in_background, document.batch_id, owner)
+        self.assertEqual(bulk.recover_interrupted_batches(), [])  # Claimed
+
+        # The run of the previous owner stops as soon as it starts, without touching the documents
+        with patch("chat_with_document.bulk._prepare") as mock_prepare:
+            with self.assertRaises(bulk.ClaimLost):
+                bulk.ingest_batch(document.batch_id, document.batch.owner)
+        mock_prepare.assert_not_called()
+
+    @override_settings(BULK_STALE_SECONDS=60)
+    @patch("chat_with_document.bulk.drop_collection")
+    @patch("chat_with_document.bulk._executor")
+    def test_batch_queued_in_a_live_process_is_not_recovered(self, mock_executor, mock_drop):
+        document = self.processing_document()
+        self.addCleanup(bulk._owned.clear)
+        bulk._queue(document.batch_id, document.batch.owner)  # Waiting behind another batch
+        UploadBatch.objects.filter(id=document.batch_id).update(updated_at=timezone.now() - timedelta(minutes=5))
+
+        bulk._heartbeat()
+        self.assertEqual(bulk.recover_interrupted_batches(), [])
+        mock_drop.assert_not_called()
+
+
+class AccountingTests(TestCase):
+    """Usage is buffered and rolled up per user, document and day; quotas refuse work up front."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username="metered", email="metered@example.com", password="secret-pass-123"
+        )
+        cls.document = UploadDocument.objects.create(
+            user=cls.user, file="documents/metered.pdf", status="completed", vector_bytes=4096
+        )
+
+    def setUp(self):
+        cache.clear()
+        accounting.flush()
+        self.client.force_login(self.user)
+
+    def test_flush_adds_buffered_usage_to_one_daily_row(self):
+        accounting.record(self.user.id, self.document.id, llm_calls=1, prompt_tokens=100, completion_tokens=20)
+        accounting.record(self.user.id, self.document.id, llm_calls=1, prompt_tokens=50, completion_tokens=5)
+        self.assertFalse(UsageRollup.objects.exists())
+        self.assertEqual(accounting.usage_today(self.user.id)["llm_tokens"], 175)  # Buffered usage counts for quotas
+        accounting.flush()
+        accounting.record(self.user.id, self.document.id, ingest_cpu_seconds=1.5, chunks_embedded=10)
+        accounting.flush()
+
+        rollup = UsageRollup.objects.get(user=self.user)
+        self.assertEqual((rollup.llm_calls, rollup.prompt_tokens, rollup.completion_tokens), (2, 150, 25))
+        self.assertEqual((rollup.ingest_cpu_seconds, rollup.chunks_embedded), (1.5, 10))
+
+    def test_usage_without_a_document_goes_to_one_daily_row(self):
+        for _ in range(2):
+            accounting.record(self.user.id, None, llm_calls=1)
+            accounting.flush()
+        self.assertEqual(UsageRollup.objects.get(user=self.user, document=None).llm_calls, 2)
+        with self.assertRaises(IntegrityError):
+            UsageRollup.objects.create(user=self.user, document=None, day=timezone.now().date())
+
+    @override_settings(QUOTA_DAILY_LLM_TOKENS=1000)
+    def test_chat_over_token_quota_is_refused_until_tomorrow(self):
+        UsageRollup.objects.create(
+            user=self.user, document=self.document, day=timezone.now().date(), prompt_tokens=900, completion_tokens=100
+        )
+        session = ChatSession.objects.create(user=self.user, document=self.document)
+        response = self.client.post(
+            reverse("chat_with_document", kwargs={"session_id": session.id}),
+            data=json.dumps({"message": "What is the revenue?"}), content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["error"], "quota_exceeded")
+        self.assertGreater(int(response["Retry-After"]), 0)
+
+    @override_settings(QUOTA_VECTOR_BYTES=4096)
+    def test_upload_over_storage_quota_is_refused(self):
+        response = self.client.post(reverse("bulk_upload"), {"files": [SimpleUploadedFile("a.pdf", b"%PDF-1.4 a")]})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.has_header("Retry-After"))
+        self.assertEqual(UploadDocument.objects.count(), 1)
+
+
+@skipUnless(os.getenv("CHROMA_TEST_PORT"), "start a server with `chroma run --port 8000` and set CHROMA_TEST_PORT")
+@override_settings(
+    VECTOR_STORE_BACKEND="chroma",
+    CHROMA_MODE="server",
+    CHROMA_SERVER={"host": "localhost", "port": int(os.getenv("CHROMA_TEST_PORT", "0")), "ssl": False, "token": ""},
+)
+class ChromaServerTests(SimpleTestCase):
+    """Client/server mode against a locally started Chroma server."""
+
+    collection_name = "test_chroma_server"
+
+    def tearDown(self):
+        drop_collection(self.collection_name)
+
+    @patch("chat_with_document.utils.get_embedding_model", return_value=DeterministicFakeEmbedding(size=16))
+    def test_store_and_search_through_shared_client(self, mock_model):
+        self.assertIs(get_chroma_client(), get_chroma_client())
+        vectorstore = get_vectorstore(self.collection_name, chunk_count=2)
+        vectorstore.add_texts(["the budget is five dollars", "the report was written by the office"])
+
+        results = get_vectorstore(self.collection_name).similarity_search("the budget is five dollars", k=1)
+        self.assertEqual(results[0].page_content, "the budget is five dollars")
+
+
+class SummaryRequestTests(SimpleTestCase):
+    """Only whole-document overview questions are answered from the precomputed summary."""
+
+    def test_summary_requests(self):
+        for question in ["Summarize this document", "give me a summary of the PDF?", "What is this document about?"]:
+            self.assertEqual(classify_summary_request(question), "summary", question)
+
+    def test_key_points_requests(self):
+        for question in ["What are the key points?", "main takeaways of this document"]:
+            self.assertEqual(classify_summary_request(question), "key_points", question)
+
+    def test_specific_questions_use_retrieval(self):
+        for question in ["summarize section 3", "what are the key points about taxes", "Who wrote this?"]:
+            self.assertIsNone(classify_summary_request(question), question)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """LLM admission control fails fast instead of queueing without bound."""
+
+    def test_user_token_bucket(self):
+        controller = AdmissionController(max_concurrent=4, max_queue=4, queue_timeout=1, user_rate=0.1, user_burst=2)
+        for _ in range(2):
+            with controller.admit(user_id=1):
+                pass
+        with self.assertRaises(AdmissionRejected) as ctx:
+            with controller.admit(user_id=1):
+                pass
+        self.assertEqual(ctx.exception.reason, "rate_limited")
+        # Other users have their own bucket
+        with controller.admit(user_id=2):
+            pass
+
+    def test_busy_when_queue_is_full(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1, user_rate=0, user_burst=0)
+        release = threading.Event()
+        admitted = threading.Event()
+
+        def hold_slot():
+            with controller.admit():
+                admitted.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_slot)
+        thread.start()
+        admitted.wait()
+        try:
+            with self.assertRaises(AdmissionRejected) as ctx:
+                with controller.admit():
+                    pass
+            self.assertEqual(ctx.exception.reason, "busy")
+        finally:
+            release.set()
+            thread.join()
+
+    def test_busy_rejection_costs_no_token(self):
+        controller = AdmissionController(max_concurrent=0, max_queue=0, queue_timeout=1, user_rate=0.001, user_burst=1)
+        for _ in range(3):
+            with self.assertRaises(AdmissionRejected) as ctx:
+                with controller.admit(user_id=1):
+                    pass
+            self.assertEqual(ctx.exception.reason, "busy")
+
+    def test_queue_deadline(self):
+        controller = AdmissionController(max_concurrent=0, max_queue=1, queue_timeout=0.05, user_rate=0, user_burst=0)
+        with self.assertRaises(AdmissionRejected):
+            with controller.admit():
+                pass
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Identical in-flight questions share one upstream computation."""
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "answer"
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do("key", compute))) for _ in range(5)]
+        coalesced_before = metrics.snapshot()["counters"].get("test.coalesced", 0)
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # Release the leader only once every follower is waiting on it
+        while metrics.snapshot()["counters"].get("test.coalesced", 0) - coalesced_before < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["answer"] * 5)
+
+    @patch("chat_with_document.rag.get_precomputed_answer", return_value=None)
+    def test_rate_limited_user_does_not_affect_others_asking_the_same(self, mock_precomputed):
+        admission = AdmissionController(max_concurrent=4, max_queue=4, queue_timeout=1, user_rate=0.001, user_burst=1)
+        admission.take_token(user_id=1)  # User 1 has no tokens left
+        started = threading.Event()
+        release = threading.Event()
+
+        def generate_answer(*args):
+            started.set()
+            release.wait()
+            return "answer"
+
+        results = {}
+
+        def ask(user_id):
+            results[user_id] = process_user_question("What is the budget?", "collection", user_id=user_id)
+
+        with patch("chat_with_document.rag.llm_admission", admission), \
+                patch("chat_with_document.rag.generate_answer", side_effect=generate_answer) as mock_generate:
+            leader = threading.Thread(target=ask, args=(2,))
+            leader.start()
+            started.wait()
+            with self.assertRaises(AdmissionRejected) as ctx:
+                ask(1)  # Rejected on its own, without joining or disturbing the flight
+            self.assertEqual(ctx.exception.reason, "rate_limited")
+            coalesced_before = metrics.snapshot()["counters"].get("rag.coalesced", 0)
+            follower = threading.Thread(target=ask, args=(3,))
+            follower.start()
+            while metrics.snapshot()["counters"].get("rag.coalesced", 0) == coalesced_before:
+                time.sleep(0.01)
+            release.set()
+            leader.join()
+            follower.join()
+
+        self.assertEqual(results, {2: "answer", 3: "answer"})
+        mock_generate.assert_called_once()
+
+    def test_completed_calls_are_not_cached(self):
+        flights = SingleFlight("test")
+        self.assertEqual(flights.do("key", lambda: 1), 1)
+        self.assertEqual(flights.do("key", lambda: 2), 2)
+
+
+class _FakeChain:
+    """Stands in for an LLM chain; each invoke() plays the next step: an answer, an exception or an Event to wait for first."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, inputs, config=None):
+        with self._lock:
+            step = self.steps[self.calls]
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if isinstance(step, tuple):
+                step[0].wait()
+                step = step[1]
+            if isinstance(step, Exception):
+                raise step
+            return step
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@override_settings(LLM_RETRY_BACKOFF=0, LLM_SLO_SECONDS=5, LLM_TIMEOUT=5, LLM_HEDGING=False, LLM_FALLBACK_MODEL="fast")
+class AnswerQuestionTests(SimpleTestCase):
+    """Retries, hedging and fallback all take an admission slot, and none outlives it."""
+
+    def _answer(self, primary, fallback=None, max_concurrent=4):
+        admission = AdmissionController(max_concurrent=max_concurrent, max_queue=4, queue_timeout=1, user_rate=0, user_burst=0)
+        chains = {settings.LLM_PRIMARY_MODEL: primary, "fast": fallback or _FakeChain()}
+        with patch("chat_with_document.llm.llm_admission", admission), \
+                patch("chat_with_document.llm._chat_model", side_effect=lambda model: model), \
+                patch("chat_with_document.llm.create_stuff_documents_chain", side_effect=lambda model, prompt: chains[model]):
+            answer, path, _ = llm.answer_question(None, "question?", [])
+        return answer, path, admission
+
+    def _wait_idle(self, admission):
+        deadline = time.monotonic() + 5
+        while admission._active and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(admission._active, 0)
+
+    def test_failed_attempt_is_retried(self):
+        primary = _FakeChain(RuntimeError("503"), "answer")
+        answer, path, admission = self._answer(primary)
+        self.assertEqual((answer, path, primary.calls), ("answer", "primary_retry", 2))
+        self._wait_idle(admission)
+
+    @override_settings(LLM_HEDGING=True)
+    @patch("chat_with_document.llm._hedge_delay", return_value=0.05)
+    def test_slow_attempt_is_hedged(self, mock_delay):
+        release = threading.Event()
+        primary = _FakeChain((release, "slow"), "hedged")
+        answer, path, admission = self._answer(primary)
+        self.assertEqual((answer, path), ("hedged", "primary_hedge"))
+        self.assertEqual(admission._active, 1)  # The slow attempt keeps its slot until it ends
+        release.set()
+        self._wait_idle(admission)
+
+    @override_settings(LLM_HEDGING=True)
+    @patch("chat_with_document.llm._hedge_delay", return_value=0.01)
+    def test_no_hedge_without_a_free_slot(self, mock_delay):
+        release = threading.Event()
+        primary = _FakeChain((release, "answer"), "hedged")
+        threading.Timer(0.2, release.set).start()
+        answer, path, admission = self._answer(primary, max_concurrent=1)
+        self.assertEqual((answer, path, primary.calls, primary.max_active), ("answer", "primary", 1, 1))
+        self._wait_idle(admission)
+
+    @override_settings(LLM_SLO_SECONDS=0.1)
+    def test_missed_deadline_falls_back(self):
+        release = threading.Event()
+        primary = _FakeChain((release, "late"))
+        answer, path, admission = self._answer(primary, fallback=_FakeChain("fast answer"), max_concurrent=2)
+        self.assertEqual((answer, path), ("fast answer", "fallback"))
+        self.assertEqual(admission._active, 1)  # The abandoned primary call still counts
+        release.set()
+        self._wait_idle(admission)
+
+    def test_busy_is_not_retried_or_sent_to_the_fallback(self):
+        primary, fallback = _FakeChain("answer"), _FakeChain("fast answer")
+        with self.assertRaises(AdmissionRejected):
+            self._answer(primary, fallback=fallback, max_concurrent=0)
+        self.assertEqual((primary.calls, fallback.calls), (0, 0))
+
+
+class MmapVectorStoreTests(SimpleTestCase):
+    """Append-only segments with tombstones: every write keeps search and get() consistent."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.embedding = DeterministicFakeEmbedding(size=8)
+
+    def store(self, **kwargs):
+        return MmapVectorStore("test", self.embedding, path=self.path, **kwargs)
+
+    def add(self, store, *names):
+        # Each name gets a basis vector, so the nearest neighbour of a basis vector is known exactly
+        store.add_embeddings(
+            [f"text {name}" for name in names], [np.eye(8)[name] for name in names],
+            metadatas=[{"n": name} for name in names], ids=[f"id{name}" for name in names],
+        )
+
+    def nearest(self, store, name, k=1):
+        return [doc.id for doc in store.similarity_search_by_vector(list(np.eye(8)[name]), k=k)]
+
+    def segments(self):
+        with open(os.path.join(self.path, "test", "manifest.json")) as f:
+            return json.load(f)["segments"]
+
+    def test_adds_are_appended_and_searchable(self):
+        store = self.store()
+        for name in range(5):
+            self.add(store, name)
+        self.assertEqual(self.nearest(store, 3), ["id3"])
+        self.assertEqual(sorted(store.get()["ids"]), [f"id{name}" for name in range(5)])
+        self.assertEqual(self.nearest(self.store(dtype="float16", rescore=False), 4), ["id4"])
+
+    def test_delete_hides_rows_without_rewriting(self):
+        store = self.store()
+        self.add(store, 0, 1, 2, 3)
+        segment = self.segments()[0]["name"]
+        store.delete(["id1"])
+        self.assertEqual(self.segments()[0]["name"], segment)  # Only a tombstone was written
+        self.assertNotIn("id1", self.nearest(store, 1, k=4))
+        self.assertEqual(sorted(store.get()["ids"]), ["id0", "id2", "id3"])
+
+    def test_update_metadatas_keeps_vectors(self):
+        store = self.store()
+        self.add(store, 0, 1, 2)
+        store.update_metadatas(["id1"], [{"n": 1, "page": 7}])
+        self.assertEqual(store.get(where={"page": 7})["ids"], ["id1"])
+        self.assertEqual(len(store.get()["ids"]), 3)
+        result = store.similarity_search_by_vector(list(np.eye(8)[1]), k=1)[0]
+        self.assertEqual((result.id, result.metadata), ("id1", {"n": 1, "page": 7}))
+
+    def test_reopen_sees_the_same_data(self):
+        store = self.store()
+        self.add(store, 0, 1)
+        self.add(store, 2)
+        store.delete(["id0"])
+        reopened = self.store()
+        self.assertEqual(sorted(reopened.get()["ids"]), ["id1", "id2"])
+        self.assertEqual(self.nearest(reopened, 2), ["id2"])
+
+    def test_segments_are_merged_and_tombstones_compacted(self):
+        store = self.store()
+        for name in range(64):
+            store.add_embeddings([f"text {name}"], [np.eye(8)[name % 8] + name / 100], ids=[f"id{name}"])
+        self.assertLessEqual(len(self.segments()), 7)  # O(log n) segments
+        store.delete([f"id{name}" for name in range(40)])
+        self.assertEqual([(entry["count"], entry["deleted"]) for entry in self.segments()], [(24, [])])
+        self.assertEqual(len(os.listdir(os.path.join(self.path, "test"))), 3)  # Segment, manifest, lock
+        self.assertEqual(sorted(store.get()["ids"]), sorted(f"id{name}" for name in range(40, 64)))
+
+
+@override_settings(RERANK_ENABLED=True, RERANK_CANDIDATES=3)
+class RerankCandidatesTests(SimpleTestCase):
+    @patch("chat_with_document.rerank.rerank_documents", side_effect=lambda question, documents: documents)
+    def test_reranker_sees_the_top_candidates_by_similarity(self, mock_rerank):
+        query = [1.0, 0.0]
+        store = MmapVectorStore("test", Mock(embed_query=Mock(return_value=query)), path=tempfile.mkdtemp())
+        # Three near-duplicates closest to the query, and a less similar but different chunk
+        store.add_embeddings(["close"] * 3 + ["different"], [[1.0, 0.3]] * 3 + [[1.0, -0.6]])
+        with patch("chat_with_document.rag.get_vectorstore", return_value=store):
+            documents = get_retriever("test").invoke("question")
+        # MMR would have swapped a near-duplicate for "different" before the cross-encoder saw them
+        self.assertEqual([doc.page_content for doc in documents], ["close"] * 3)
+
+
+class _WordTokenizer:
+    """One token per word, and [CLS]/[SEP] around each sequence like a BERT tokenizer."""
+
+    def tokenize(self, text):
+        return text.split()
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+
+@override_settings(CHUNKING_STRATEGIES={
+    "recursive": {"splitter": "characters", "chunk_size": 1000, "chunk_overlap": 200},
+    "token": {"splitter": "tokens", "chunk_size": None, "chunk_overlap": 0.1},
+    "small": {"splitter": "tokens", "chunk_size": 50, "chunk_overlap": 0},
+}, DEFAULT_CHUNKING_STRATEGY="recursive")
+@patch("chat_with_document.chunking._tokenizer_and_limit", return_value=(_WordTokenizer(), 12))
+class ChunkingTests(SimpleTestCase):
+    def test_strategy_selects_the_splitter(self, mock_tokenizer):
+        splitter = get_text_splitter()
+        self.assertEqual((splitter._chunk_size, splitter._chunk_overlap), (1000, 200))
+        self.assertEqual(get_text_splitter("token")._chunk_size, 10)
+        with self.assertRaises(ValueError):
+            get_text_splitter("unknown")
+
+    def test_token_chunks_fit_the_model_with_special_tokens(self, mock_tokenizer):
+        text = " ".join(f"word{i}" for i in range(100))
+        for strategy in ("token", "small"):
+            chunks = get_text_splitter(strategy).split_text(text)
+            self.assertTrue(chunks)
+            self.assertLessEqual(max(len(chunk.split()) for chunk in chunks) + 2, 12)
+
+
+@override_settings(
+    CHROMA_HNSW_TIERS=[(100, {"hnsw:M": 16, "hnsw:search_ef": 50}), (None, {"hnsw:M": 32, "hnsw:search_ef": 100})],
+    CHROMA_HNSW_OVERRIDES={},
+)
+class HnswParamsTests(SimpleTestCase):
+    def test_tier_is_picked_from_chunk_count(self):
+        self.assertEqual(hnsw_params(100)["hnsw:M"], 16)
+        self.assertEqual(hnsw_params(101)["hnsw:M"], 32)
+
+    def test_overrides_apply_on_top_of_the_tier(self):
+        with self.settings(CHROMA_HNSW_OVERRIDES={"hnsw:search_ef": 150}):
+            self.assertEqual(hnsw_params(10), {"hnsw:M": 16, "hnsw:search_ef": 150})
+
+
+@override_settings(VECTOR_STORE_BACKEND="chroma", CHROMA_MODE="embedded", CHROMA_DB_PATH=tempfile.mkdtemp())
+class SweepHnswTests(SimpleTestCase):
+    """sweep_hnsw builds each index once, with the query vectors held out of it."""
+
+    def test_each_index_is_built_once_and_queried_with_every_search_ef(self):
+        collection = get_chroma_client().create_collection("test_sweep")
+        collection.add(ids=[str(i) for i in range(60)], embeddings=np.random.default_rng(1).random((60, 8)).tolist())
+        out = io.StringIO()
+        with patch.object(sweep_hnsw.Command, "build", autospec=True, side_effect=sweep_hnsw.Command.build) as build:
+            call_command(
+                "sweep_hnsw", "test_sweep", m=[8], construction_ef=[50], search_ef=[5, 100], queries=10, k=3,
+                target_recall=1.0, stdout=out,
+            )
+        build.assert_called_once()
+        self.assertEqual(len(build.call_args.args[2]), 50)  # The 10 queries are not indexed
+        rows = [line.split() for line in out.getvalue().splitlines() if line.startswith("   8")]
+        self.assertEqual([row[2] for row in rows], ["5", "100"])
+        self.assertEqual(rows[1][-1], "100.0%")  # A wide search is exact on 50 vectors
+
+    def test_missing_collection_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, "does not exist"):
+            call_command("sweep_hnsw", "test_sweep_typo", stdout=io.StringIO())
+        self.assertNotIn("test_sweep_typo", [c.name for c in get_chroma_client().list_collections()])
+
+
+@override_settings(VECTOR_STORE_BACKEND="chroma", CHROMA_MODE="embedded", CHROMA_DB_PATH=tempfile.mkdtemp())
+class ConvertToMmapStoreTests(TestCase):
+    def test_missing_collection_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, "does not exist"):
+            call_command("convert_to_mmap_store", "test_convert_typo", stdout=io.StringIO())
+        self.assertNotIn("test_convert_typo", [c.name for c in get_chroma_client().list_collections()])
+
+
+class LoggingTests(SimpleTestCase):
+    def test_queued_handler_appends_records_to_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "app.log")
+            handler = queued_handler(filename, console=False, fmt="%(levelname)s %(message)s")
+            handler.handle(logging.makeLogRecord({"levelno": logging.INFO, "levelname": "INFO", "msg": "queued"}))
+            handler.queue.join()  # Wait for the listener thread to write it
+            handler.listener.handlers[0].close()
+            with open(filename) as f:
+                self.assertEqual(f.read(), "INFO queued\n")
+
+    def test_django_records_only_go_through_the_queued_handler(self):
+        # A record goes through every handler of its logger and its ancestors until propagation stops
+        handlers, logger = [], logging.getLogger("django.request")
+        while logger:
+            handlers += logger.handlers
+            logger = logger.parent if logger.propagate else None
+        self.assertEqual([handler.name for handler in handlers], ["queued"])
+
+    def test_sampled_debug_filter_only_samples_debug(self):
+        debug = logging.makeLogRecord({"levelno": logging.DEBUG})
+        info = logging.makeLogRecord({"levelno": logging.INFO})
+        self.assertFalse(SampledDebugFilter(rate=0).filter(debug))
+        self.assertTrue(SampledDebugFilter(rate=0).filter(info))
+        self.assertTrue(SampledDebugFilter(rate=1).filter(debug))
@@ -0,0 +1,170 @@
+import logging
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from .models import ChunkedUpload, UploadDocument
+from .utils import file_hash
+
+logger = logging.getLogger(__name__)
+
+
+# Resumable chunked upload protocol
+#   1. create_chunked_upload()  -> upload id, chunk size and current offset
+#   2. write_chunk()            -> append the bytes at `offset`, returns the new offset
+#   3. get the ChunkedUpload    -> resume: the client continues from `offset`
+#   4. finalize_chunked_upload() -> hashes the file, moves it under MEDIA_ROOT/documents/ and creates the UploadDocument
+# Uploads that receive nothing for CHUNKED_UPLOAD_EXPIRY seconds are deleted with their partial file.
+class ChunkedUploadError(Exception):
+    """Raised for protocol errors; `status` is the HTTP status code to answer with."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+# Abandoned uploads are looked for at most this often per process, when an upload starts
+_EXPIRY_CHECK_INTERVAL = 3600
+_next_expiry_check = 0
+
+
+def partial_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, "uploads", "partial", f"{upload.id}.part")
+
+
+def create_chunked_upload(user, filename, size):
+    """
+    Starts a chunked upload for a PDF of `size` bytes.
+    """
+    global _next_expiry_check
+    filename = os.path.basename(filename or "")
+    if not filename.lower().endswith(".pdf"):
+        raise ChunkedUploadError("Only PDF files can be uploaded.")
+    if size <= 0:
+        raise ChunkedUploadError("File is empty.")
+    if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        raise ChunkedUploadError("File is too large.", status=413)
+
+    if time.monotonic() >= _next_expiry_check:
+        _next_expiry_check = time.monotonic() + _EXPIRY_CHECK_INTERVAL
+        expire_abandoned_uploads()
+
+    upload = ChunkedUpload.objects.create(
+        user=user, filename=filename, size=size, chunk_size=settings.CHUNKED_UPLOAD_CHUNK_SIZE
+    )
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    return upload
+
+
+def expire_abandoned_uploads():
+    """
+    Deletes the uploads that have received nothing for CHUNKED_UPLOAD_EXPIRY seconds, and their partial files.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+    expired = 0
+    for upload in ChunkedUpload.objects.filter(status="uploading", updated_at__lt=cutoff):
+        # The row goes first and only if still idle: a chunk written meanwhile keeps the upload alive
+        deleted, _ = ChunkedUpload.objects.filter(id=upload.id, status="uploading", updated_at__lt=cutoff).delete()
+        if deleted:
+            expired += 1
+            try:
+                os.remove(partial_path(upload))
+            except FileNotFoundError:
+                pass
+    if expired:
+        logger.info(f"Expired {expired} abandoned chunked uploads")
+
+
+def write_chunk(user, upload_id, offset, stream):
+    """
+    Writes one chunk read from `stream` at `offset` straight to the partial file.
+    Chunks must arrive in order; a mismatched offset is answered with the expected one.
+    """
+    with transaction.atomic():
+        # Row lock serializes concurrent writes to the same upload across workers.
+        upload = ChunkedUpload.objects.select_for_update().filter(id=upload_id, user=user).first()
+        if upload is None:
+            raise ChunkedUploadError("Upload not found.", status=404)
+        if upload.status != "uploading":
+            raise ChunkedUploadError("Upload is already finalized.", status=409, offset=upload.offset)
+        if offset != upload.offset:
+            raise ChunkedUploadError("Unexpected offset.", status=409, offset=upload.offset)
+
+        limit = min(upload.chunk_size, upload.size - upload.offset)
+        written = 0
+        with open(partial_path(upload), "r+b") as f:
+            f.seek(offset)
+            while True:
+                block = stream.read(min(64 * 1024, limit + 1 - written))
+                if not block:
+                    break
+                written += len(block)
+                if written > limit:
+                    raise ChunkedUploadError("Chunk is larger than the chunk size.", status=413, offset=upload.offset)
+                f.write(block)
+
+        if written == 0:
+            raise ChunkedUploadError("Empty chunk.", offset=upload.offset)
+        if written < limit:
+            # Only the last chunk may be short; anything else is a dropped connection.
+            raise ChunkedUploadError("Incomplete chunk.", offset=upload.offset)
+
+        upload.offset += written
+        upload.save(update_fields=["offset", "updated_at"])
+    return upload
+
+
+def finalize_chunked_upload(user, upload_id):
+    """
+    Moves a fully received upload under MEDIA_ROOT and creates its UploadDocument. Returns (document, created):
+    only the call that created the document ingests it; retries get the existing document.
+    """
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().filter(id=upload_id, user=user).first()
+        if upload is None:
+            raise ChunkedUploadError("Upload not found.", status=404)
+        if upload.status == "complete":
+            return upload.document, False
+        if upload.offset != upload.size:
+            raise ChunkedUploadError("Upload is not complete.", status=409, offset=upload.offset)
+
+        path = partial_path(upload)
+        with open(path, "r+b") as f:
+            f.truncate(upload.size)
+        # Hashed once here rather than per chunk: chunks of one upload can land on any worker process
+        content_hash = file_hash(path)
+
+        name = default_storage.get_available_name(f"documents/{upload.filename}")
+        final_path = default_storage.path(name)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(path, final_path)
+
+        document = UploadDocument(user=user, content_hash=content_hash, status="processing")
+        document.file.name = name
+        document.save()
+
+        upload.document = document
+        upload.status = "complete"
+        upload.save(update_fields=["document", "status", "updated_at"])
+
+    logger.info(f"Chunked upload {upload.id} finalized as document {document.id}")
+    return document, True
+
+
+def claim_interrupted_ingestion(document):
+    """
+    Claims a chunked-upload document whose ingestion never finished. Ingestion runs inside the finalize
+    request, so a document still "processing" CHUNKED_UPLOAD_RESUME_AFTER seconds after its upload was
+    finalized (or last claimed) has nobody working on it. Returns whether this caller won the claim.
+    """
+    if document.status != "processing":
+        return False
+    cutoff = timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_RESUME_AFTER)
+    claimed = ChunkedUpload.objects.filter(document=document, updated_at__lt=cutoff).update(updated_at=timezone.now())
+    return bool(claimed)
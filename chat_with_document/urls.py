@@ -31,6 +31,12 @@ urlpatterns = [
     path('upload/', upload_document, name='upload_document'),
     path('list/', list_documents, name='list_documents'),
     path('list/delete/<uuid:doc_id>', delete_document, name='delete_document'),
+    path('list/replace/<uuid:doc_id>', views.replace_document, name='replace_document'),
+    path('upload/chunked/', views.chunked_upload_start, name='chunked_upload_start'),
+    path('upload/chunked/<uuid:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    path('upload/chunked/<uuid:upload_id>/finalize/', views.chunked_upload_finalize, name='chunked_upload_finalize'),
+    path('upload/bulk/', views.bulk_upload, name='bulk_upload'),
+    path('upload/bulk/<uuid:batch_id>/', views.bulk_upload_progress, name='bulk_upload_progress'),
 
 
 
@@ -39,5 +45,10 @@ urlpatterns = [
     path("chat/<uuid:session_id>/", views.chat_with_document, name="chat_with_document"),
     path('chat-interface/<uuid:session_id>/', chat_interface, name='chat_interface'),
     path('chat-history/<uuid:session_id>/', views.chat_history, name='chat_history'),
+    path('chat-history/search/', views.search_chat_history, name='search_chat_history'),
     path('start-chat/<uuid:document_id>/', views.start_chat, name='start_chat'),
+
+    # Monitoring
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('usage/', views.usage_view, name='usage'),
 ]
\ No newline at end of file
@@ -1,9 +1,23 @@
+import glob
+import gzip
+import hashlib
+import json
 import logging
+import os
+import re
+import uuid
+import pypdf
+from functools import lru_cache
+from collections import Counter
+from django.conf import settings
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from .chunking import get_text_splitter
+from .mmap_store import MmapVectorStore
+from .vectordb import get_chroma_client
 
 
 # Chat App
@@ -21,34 +35,270 @@ email_verification_token = EmailVerificationTokenGenerator()
 
 
 # Upload Document App UTILS
-# Setup Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Load Embedding Model
-# embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L12-v2")
+# Documents record the model they were embedded with (UploadDocument.embedding_model_name), so several
+# models can be in use while `manage.py migrate_embeddings` moves documents to settings.EMBEDDING_MODEL.
+@lru_cache(maxsize=None)
+def _load_embedding_model(model_name):
+    return HuggingFaceEmbeddings(model_name=model_name)
 
 
-def store_embeddings_in_chroma(pdf_path, collection_name):
+def get_embedding_model(model_name=None):
+    return _load_embedding_model(model_name or settings.EMBEDDING_MODEL)
+
+
+embedding_model = get_embedding_model()
+
+
+def normalize_question(question):
+    """
+    Lower-cases a question and collapses whitespace and trailing punctuation, so trivially
+    different spellings of the same question compare equal.
+    """
+    return re.sub(r"\s+", " ", re.sub(r"[?.!]+$", "", (question or "").strip().lower()))
+
+
+def file_hash(path):
+    """
+    SHA-256 of a file's contents, read in blocks.
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def page_hash(text):
+    """
+    Stable hash of a page's extracted text, used to detect which pages changed between revisions.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Bump when the extraction code changes so cached text is re-extracted
+PDF_EXTRACTOR_VERSION = f"pypdf-{pypdf.__version__}-1"
+
+
+def _extracted_text_prefix(pdf_path):
+    directory, name = os.path.split(pdf_path)
+    return os.path.join(directory, f".{name}.")
+
+
+def extracted_text_cache_path(pdf_path, content_hash):
     """
-    Extracts text from a PDF, generates embeddings, and stores them in ChromaDB.
+    Extracted-text cache file next to the PDF, keyed by file hash and extractor version.
+    """
+    return f"{_extracted_text_prefix(pdf_path)}{content_hash[:16]}.{PDF_EXTRACTOR_VERSION}.pages.json.gz"
+
+
+def delete_extracted_text_cache(pdf_path):
+    """
+    Removes every cached extraction of a PDF (e.g. when the file is replaced or deleted).
+    """
+    for path in glob.glob(glob.escape(_extracted_text_prefix(pdf_path)) + "*.pages.json.gz"):
+        os.remove(path)
+
+
+def _extract_pdf_pages(pdf_path, content_hash):
+    cache_path = extracted_text_cache_path(pdf_path, content_hash)
+    try:
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            return [Document(page_content=page["text"], metadata=page["metadata"]) for page in json.load(f)]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable extracted-text cache {cache_path}: {e}")
+
+    pages = PyPDFLoader(pdf_path).load()
+    # Written to a temporary file and renamed, so readers never see a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump([{"text": page.page_content, "metadata": page.metadata} for page in pages], f)
+    os.replace(tmp_path, cache_path)
+    return pages
+
+
+def load_pdf_pages(pdf_path, content_hash=None):
+    """
+    Extracts one Document per PDF page and tags each with the hash of its text.
+    The extraction is cached on disk, so re-splitting or re-embedding never parses the PDF again.
+    """
+    pages = _extract_pdf_pages(pdf_path, content_hash or file_hash(pdf_path))
+    for page in pages:
+        page.metadata["page_hash"] = page_hash(page.page_content)
+    return pages
+
+
+def split_pages(pages, chunking_strategy=None, embedding_model_name=None):
+    """
+    Splits pages into chunks. Pages are split independently, so a chunk never spans two pages.
+    """
+    text_splitter = get_text_splitter(chunking_strategy, embedding_model_name)
+    return text_splitter.split_documents(pages)
+
+
+def hnsw_params(chunk_count):
+    """
+    HNSW parameters for a new Chroma collection of `chunk_count` chunks (see settings.CHROMA_HNSW_TIERS).
+    """
+    for max_chunks, params in settings.CHROMA_HNSW_TIERS:
+        if max_chunks is None or chunk_count <= max_chunks:
+            return dict(params, **settings.CHROMA_HNSW_OVERRIDES)
+    return dict(settings.CHROMA_HNSW_OVERRIDES)
+
+
+def get_vectorstore(collection_name, embedding_model_name=None, chunk_count=None):
+    """
+    Returns the vector store for a collection, using the backend selected by settings.VECTOR_STORE_BACKEND.
+    Queries are embedded with `embedding_model_name`, which must be the model the collection was built with.
+    Pass `chunk_count` only when creating a collection, to size its HNSW index (the mmap store is exact).
+    """
+    embedding_function = get_embedding_model(embedding_model_name)
+    if settings.VECTOR_STORE_BACKEND == "mmap":
+        return MmapVectorStore(collection_name, embedding_function)
+    collection_metadata = hnsw_params(chunk_count) if chunk_count is not None else None
+    return Chroma(
+        client=get_chroma_client(), collection_name=collection_name,
+        embedding_function=embedding_function, collection_metadata=collection_metadata,
+    )
+
+
+def drop_collection(collection_name):
+    """
+    Deletes a whole collection and its vectors.
+    """
+    get_vectorstore(collection_name).delete_collection()
+
+
+def collection_stats(collection_name, embedding_model_name=None):
+    """
+    Returns (chunk count, vector bytes) of a collection. The mmap store reports its actual size on disk;
+    Chroma does not expose per-collection disk usage, so its float32 vector payload is estimated.
+    """
+    vectorstore = get_vectorstore(collection_name, embedding_model_name)
+    if isinstance(vectorstore, MmapVectorStore):
+        size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(vectorstore.directory)
+            for name in files
+        )
+        return vectorstore._snapshot().count, size
+    count = vectorstore._collection.count()
+    if not count:
+        return 0, 0
+    sample = vectorstore._collection.get(limit=1, include=["embeddings"])["embeddings"]
+    return count, count * len(sample[0]) * 4
+
+
+def add_embedded_chunks(vectorstore, chunks, embeddings):
+    """
+    Adds chunks whose embeddings were computed elsewhere (e.g. in a batch shared with other documents).
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    if isinstance(vectorstore, MmapVectorStore):
+        vectorstore.add_embeddings(texts, embeddings, metadatas, ids)
+    else:
+        vectorstore._collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts)
+
+
+def update_chunk_metadatas(vectorstore, ids, metadatas):
+    """
+    Replaces chunk metadata in place, without re-embedding.
+    """
+    if isinstance(vectorstore, MmapVectorStore):
+        vectorstore.update_metadatas(ids, metadatas)
+    else:
+        vectorstore._collection.update(ids=ids, metadatas=metadatas)
+
+
+def store_embeddings_in_chroma(pdf_path, collection_name, chunking_strategy=None, embedding_model_name=None,
+                               content_hash=None):
+    """
+    Extracts text from a PDF, generates embeddings, and stores them in the vector store.
+    Returns the per-page text hashes so a later revision can be re-indexed incrementally.
+    Pass the file's content_hash when it is already known, so the file is not hashed again.
     """
     try:
         # Load PDF and Extract Text
-        loader = PyPDFLoader(pdf_path)
-        documents = loader.load()
+        documents = load_pdf_pages(pdf_path, content_hash)
 
         if not documents:
             logger.error("No text extracted from PDF.")
-            return
+            return []
 
         #  Generate embeddings
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(documents)
+        splits = split_pages(documents, chunking_strategy, embedding_model_name)
 
-        Chroma.from_documents(documents=splits, embedding=embedding_model, persist_directory='./chat_with_pdf', collection_name=collection_name)
-        logger.info(f"Document stored successfully in ChromaDB for {collection_name}")
+        get_vectorstore(collection_name, embedding_model_name, chunk_count=len(splits)).add_documents(splits)
+        logger.info(f"Document stored successfully in vector store for {collection_name}")
+        return [page.metadata["page_hash"] for page in documents]
 
     except Exception as e:
         logger.error(f" Error storing embeddings: {e}", exc_info=True)
+        return []
+
+
+class PartialReindexError(Exception):
+    """Raised when re-indexing failed after it started changing the collection."""
+
+
+def reindex_changed_pages(pdf_path, collection_name, old_page_hashes, chunking_strategy=None, embedding_model_name=None,
+                          content_hash=None):
+    """
+    Re-indexes a new revision of a document into its existing collection.
+
+    Only chunks of pages whose text hash changed are replaced; vectors of unchanged pages are
+    kept (pages that merely moved get their page number updated). New chunks are added before
+    the stale ones are deleted, so a failure part way leaves extra chunks, never missing ones.
+    Returns (new_page_hashes, number_of_pages_embedded, number_of_chunks_embedded). Failures once the
+    collection is being changed raise PartialReindexError; earlier ones leave it untouched.
+    """
+    pages = load_pdf_pages(pdf_path, content_hash)
+    if not pages:
+        raise ValueError("No text extracted from PDF.")
+    new_page_hashes = [page.metadata["page_hash"] for page in pages]
+    vectorstore = get_vectorstore(collection_name, embedding_model_name)
+
+    moved = {}
+    if not old_page_hashes:
+        # Collection was built before page hashes were recorded (or a re-index failed): rebuild it.
+        stale_ids = vectorstore.get(include=[])["ids"]
+        changed = set(new_page_hashes)
+    else:
+        old_counts = Counter(old_page_hashes)
+        new_counts = Counter(new_page_hashes)
+        # A hash whose page count differs (e.g. duplicated blank pages) is rebuilt entirely
+        changed = {h for h in old_counts.keys() | new_counts.keys() if old_counts[h] != new_counts[h]}
+
+        stale = [h for h in changed if old_counts[h]]
+        stale_ids = vectorstore.get(where={"page_hash": {"$in": stale}}, include=[])["ids"] if stale else []
+
+        old_index = {h: i for i, h in enumerate(old_page_hashes) if old_counts[h] == 1}
+        moved = {h: i for i, h in enumerate(new_page_hashes) if h in old_index and h not in changed and old_index[h] != i}
+
+    # The stale ids were read first, so deleting them after the add never removes a new chunk
+    changed_pages = [page for page in pages if page.metadata["page_hash"] in changed]
+    splits = split_pages(changed_pages, chunking_strategy, embedding_model_name) if changed_pages else []
+    try:
+        if splits:
+            vectorstore.add_documents(splits)
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+
+        # Unchanged pages that moved keep their vectors; only their page number is updated.
+        if moved:
+            existing = vectorstore.get(where={"page_hash": {"$in": list(moved)}}, include=["metadatas"])
+            metadatas = [dict(metadata, page=moved[metadata["page_hash"]]) for metadata in existing["metadatas"]]
+            update_chunk_metadatas(vectorstore, existing["ids"], metadatas)
+    except Exception as e:
+        raise PartialReindexError(f"Re-indexing {collection_name} failed part way: {e}") from e
+
+    logger.info(
+        f"Re-indexed {collection_name}: {len(changed_pages)} of {len(pages)} pages embedded"
+    )
+    return new_page_hashes, len(changed_pages), len(splits)
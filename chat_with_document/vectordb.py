@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+import chromadb
+from chromadb.config import Settings
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+# One Chroma client per process, shared by all threads. In server mode it is an HTTP client whose
+# keep-alive connection pool is reused by every retrieval and ingestion, instead of paying a new
+# TCP (and TLS) handshake per request. Clients are keyed by pid, so a client created before a
+# fork (e.g. gunicorn --preload) is never shared with the workers.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _create_client():
+    client_settings = Settings(anonymized_telemetry=False)
+    if settings.CHROMA_MODE == "server":
+        config = settings.CHROMA_SERVER
+        headers = {"Authorization": f"Bearer {config['token']}"} if config["token"] else None
+        logger.info(f"Connecting to Chroma server at {config['host']}:{config['port']}")
+        return chromadb.HttpClient(
+            host=config["host"], port=config["port"], ssl=config["ssl"], headers=headers, settings=client_settings
+        )
+    if settings.CHROMA_MODE == "embedded":
+        return chromadb.PersistentClient(path=settings.CHROMA_DB_PATH, settings=client_settings)
+    raise ImproperlyConfigured(f"Unknown CHROMA_MODE: {settings.CHROMA_MODE}")
+
+
+def get_chroma_client():
+    """
+    Returns this process's Chroma client for settings.CHROMA_MODE ("embedded" or "server").
+    """
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                client = _clients[pid] = _create_client()
+    return client
+
+
+@receiver(setting_changed)
+def _reset_clients(setting, **kwargs):
+    if setting in ("CHROMA_MODE", "CHROMA_DB_PATH", "CHROMA_SERVER"):
+        with _clients_lock:
+            _clients.clear()
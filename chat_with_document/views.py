@@ -1,6 +1,7 @@
 from datetime import timezone
 import json
 import logging
+import time
 from django import forms
 from django.urls import reverse
 from django.conf import settings
@@ -9,17 +10,31 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import get_user_model
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.mail import send_mail
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from .utils import email_verification_token
 from django.contrib.auth.forms import PasswordChangeForm
 from .forms import DocumentUploadForm
-from .utils import store_embeddings_in_chroma
+from .utils import (
+    PartialReindexError, delete_extracted_text_cache, drop_collection, file_hash, reindex_changed_pages,
+    store_embeddings_in_chroma,
+)
 from django.http import JsonResponse
-from .models import ChatMessage, ChatSession, UploadDocument
+from .models import ChatMessage, ChatSession, ChunkedUpload, DocumentSummary, UploadBatch, UploadDocument
+from .summaries import schedule_document_summary
+from .uploads import (
+    ChunkedUploadError, claim_interrupted_ingestion, create_chunked_upload, finalize_chunked_upload, write_chunk,
+)
+from .bulk import BulkUploadError, batch_progress, create_bulk_upload
 from django.views.decorators.csrf import csrf_exempt
 from .rag import process_user_question
+from .search import search_messages
+from .admission import AdmissionRejected
+from .accounting import QuotaExceeded, check_upload_quota, flush as flush_usage, record_ingestion, usage_report
+from .cache import get_latest_chat_session, get_user_documents
+from . import metrics
 from django.contrib.auth.models import User
 from django.utils import timezone  # Ensure correct import
 
@@ -127,20 +142,16 @@ def index(request):
     if request.method == "POST":
         form = DocumentUploadForm(request.POST, request.FILES)
         if form.is_valid():
+            refused = upload_quota_response(request, request.headers.get("X-Requested-With") == "XMLHttpRequest")
+            if refused:
+                return refused
             document = form.save(commit=False)
             document.user = request.user
             document.collection_name = f"collection_{document.id}"
             document.status = "processing"
             document.save()
 
-            try:
-                store_embeddings_in_chroma(document.file.path, document.collection_name)
-                document.status = "completed"
-            except Exception as e:
-                document.status = "failed"
-                logger.error(f"Error processing document {document.id}: {e}", exc_info=True)
-
-            document.save()
+            process_document(document)
 
             # Return JSON response for AJAX calls
             if request.headers.get("X-Requested-With") == "XMLHttpRequest":
@@ -157,8 +168,8 @@ def index(request):
             messages.error(request, "Upload failed. Please check the errors.")
     else:
         form = DocumentUploadForm()
-    documents = UploadDocument.objects.filter(user=request.user, deleted=False).order_by("-uploaded_at")
-    chat_session = ChatSession.objects.filter(user=request.user).order_by('-created_at').first()
+    documents = get_user_documents(request.user)
+    chat_session = get_latest_chat_session(request.user)
     return render(request, "index.html", {"documents": documents, "form": form, 'chat_session': chat_session})
 
 
@@ -236,6 +247,46 @@ def logout_view(request):
 logger = logging.getLogger(__name__)
 
 
+def process_document(document):
+    """Generates embeddings for an uploaded document and records the outcome in its status."""
+    started = time.thread_time()
+    try:
+        if not document.content_hash:
+            document.content_hash = file_hash(document.file.path)
+        # Generate embeddings and store in ChromaDB
+        document.page_hashes = store_embeddings_in_chroma(
+            document.file.path, document.collection_name, document.chunking_strategy, document.embedding_model_name,
+            document.content_hash,
+        )
+        document.status = "completed"
+    except Exception as e:
+        document.status = "failed"
+        logger.error(f"Error processing document {document.id}: {e}", exc_info=True)
+
+    record_ingestion(document, time.thread_time() - started)
+    document.save()
+    if document.status == "completed":
+        schedule_document_summary(document)
+
+
+def upload_quota_response(request, ajax=True):
+    """Returns the response refusing an upload when the user is over a quota, or None."""
+    try:
+        check_upload_quota(request.user.id)
+    except QuotaExceeded as e:
+        if not ajax:
+            messages.error(request, str(e))
+            return redirect('index')
+        # 429 when the quota resets tomorrow, 403 when documents must be deleted first
+        response = JsonResponse(
+            {'success': False, 'error': str(e)}, status=403 if e.retry_after is None else 429
+        )
+        if e.retry_after is not None:
+            response['Retry-After'] = str(max(1, round(e.retry_after)))
+        return response
+    return None
+
+
 @login_required
 def upload_document(request):
     """Handles document upload with AJAX support"""
@@ -243,21 +294,16 @@ def upload_document(request):
         form = DocumentUploadForm(request.POST, request.FILES)
 
         if form.is_valid():
+            refused = upload_quota_response(request, request.headers.get('X-Requested-With') == 'XMLHttpRequest')
+            if refused:
+                return refused
             document = form.save(commit=False)
             document.user = request.user
             document.collection_name = f"collection_{document.id}"
             document.status = "processing"
             document.save()
 
-            try:
-                # Generate embeddings and store in ChromaDB
-                store_embeddings_in_chroma(document.file.path, document.collection_name)
-                document.status = "completed"
-            except Exception as e:
-                document.status = "failed"
-                logger.error(f"Error processing document {document.id}: {e}", exc_info=True)
-
-            document.save()
+            process_document(document)
             
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({'success': True})
@@ -272,10 +318,126 @@ def upload_document(request):
     return render(request, "upload.html", {"form": form})
 
 
+def _chunked_upload_response(upload):
+    return JsonResponse({
+        'success': True,
+        'upload_id': str(upload.id),
+        'chunk_size': upload.chunk_size,
+        'offset': upload.offset,
+        'size': upload.size,
+        'status': upload.status,
+    })
+
+
+def _chunked_upload_error(error):
+    return JsonResponse({'success': False, 'error': str(error), 'offset': error.offset}, status=error.status)
+
+
+@login_required
+def chunked_upload_start(request):
+    """Starts a resumable chunked upload: POST {"filename": ..., "size": ...}"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    refused = upload_quota_response(request)
+    if refused:
+        return refused
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object.")
+        upload = create_chunked_upload(request.user, data.get('filename'), int(data.get('size', 0)))
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid upload request.'}, status=400)
+    except ChunkedUploadError as e:
+        return _chunked_upload_error(e)
+    return _chunked_upload_response(upload)
+
+
+@login_required
+def chunked_upload(request, upload_id):
+    """
+    GET returns the current offset so an interrupted upload can resume.
+    PUT writes the raw request body as the chunk starting at the X-Upload-Offset header.
+    """
+    if request.method == 'GET':
+        upload = get_object_or_404(ChunkedUpload, id=upload_id, user=request.user)
+        return _chunked_upload_response(upload)
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('X-Upload-Offset', ''))
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Missing X-Upload-Offset header.'}, status=400)
+        try:
+            upload = write_chunk(request.user, upload_id, offset, request)
+        except ChunkedUploadError as e:
+            return _chunked_upload_error(e)
+        return _chunked_upload_response(upload)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@login_required
+def chunked_upload_finalize(request, upload_id):
+    """
+    Creates the UploadDocument from a fully received upload and ingests it. A retried finalize reports
+    the document's status without ingesting it again, unless the first ingestion was interrupted.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        document, created = finalize_chunked_upload(request.user, upload_id)
+    except ChunkedUploadError as e:
+        return _chunked_upload_error(e)
+
+    if created:
+        process_document(document)
+    elif claim_interrupted_ingestion(document):
+        # Chunks stored by the interrupted ingestion would be duplicated
+        drop_collection(document.collection_name)
+        process_document(document)
+
+    return JsonResponse({
+        'success': document.status == "completed",
+        'status': document.status,
+        'document': {
+            'id': str(document.id),
+            'name': document.file.name
+        }
+    })
+
+
+@login_required
+def bulk_upload(request):
+    """Accepts many PDFs and/or ZIP archives of PDFs; they are ingested together in the background."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    refused = upload_quota_response(request)
+    if refused:
+        return refused
+    try:
+        batch = create_bulk_upload(
+            request.user, request.FILES.getlist('files'), request.POST.get('chunking_strategy')
+        )
+    except BulkUploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
+
+    return JsonResponse(dict(
+        batch_progress(batch),
+        success=True,
+        progress_url=reverse('bulk_upload_progress', kwargs={'batch_id': batch.id}),
+    ), status=202)
+
+
+@login_required
+def bulk_upload_progress(request, batch_id):
+    """Aggregate ingestion progress of a bulk upload, for polling."""
+    batch = get_object_or_404(UploadBatch, id=batch_id, user=request.user)
+    return JsonResponse(batch_progress(batch))
+
+
 @login_required
 def list_documents(request):
     """Lists all user-uploaded documents."""
-    documents = UploadDocument.objects.filter(user=request.user, deleted=False).order_by("-uploaded_at")
+    documents = get_user_documents(request.user)
     return render(request, "index.html", {"documents": documents})
 
 
@@ -289,7 +451,87 @@ def delete_document(request, doc_id):
     return render(request, "index", {'document': document})
 
 
+@login_required
+def replace_document(request, doc_id):
+    """
+    Replaces a document with a new revision of the file. Only pages whose text changed are
+    re-embedded; the collection and existing chat sessions are kept.
+    """
+    document = get_object_or_404(UploadDocument, id=doc_id, user=request.user, deleted=False)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    refused = upload_quota_response(request)
+    if refused:
+        return refused
+
+    old_file_name, old_status = document.file.name, document.status
+    form = DocumentUploadForm(request.POST, request.FILES, instance=document)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'error': form.errors})
+
+    document = form.save(commit=False)
+    document.status = "processing"
+    document.save()
+
+    pages_embedded = chunks_embedded = 0
+    started = time.thread_time()
+    try:
+        content_hash = file_hash(document.file.path)
+        document.page_hashes, pages_embedded, chunks_embedded = reindex_changed_pages(
+            document.file.path, document.collection_name, document.page_hashes,
+            document.chunking_strategy, document.embedding_model_name, content_hash,
+        )
+        document.content_hash = content_hash
+        document.status = "completed"
+        replaced = True
+    except Exception as e:
+        replaced = False
+        # Only a collection changed part way may hold chunks of both revisions; otherwise the old
+        # revision is still fully indexed and keeps being served. Either way, clearing the page hashes
+        # makes the next replace rebuild the collection, and the old file is kept and the new one discarded.
+        document.status = "failed" if isinstance(e, PartialReindexError) else old_status
+        document.page_hashes = []
+        old_file_name, document.file.name = document.file.name, old_file_name
+        logger.error(f"Error re-indexing document {document.id}: {e}", exc_info=True)
+    record_ingestion(document, time.thread_time() - started, chunks_embedded)
+    document.save()
+    if replaced and pages_embedded:
+        schedule_document_summary(document)
+
+    # Remove whichever file the document no longer points to
+    if old_file_name and old_file_name != document.file.name:
+        delete_extracted_text_cache(document.file.storage.path(old_file_name))
+        document.file.storage.delete(old_file_name)
+
+    return JsonResponse({
+        'success': replaced,
+        'document': {
+            'id': str(document.id),
+            'name': document.file.name
+        },
+        'pages_embedded': pages_embedded,
+        'pages_total': len(document.page_hashes),
+    })
+
+
 # <-------------------------------------RAg Chat Views------------------------------------------------------->
+def busy_response(rejection):
+    """Fast failure when the LLM admission control does not admit a chat request."""
+    if rejection.reason == "rate_limited":
+        message = "You are sending messages too quickly. Please wait a moment and try again."
+        status = 429
+    elif rejection.reason == "quota_exceeded":
+        message = str(rejection)
+        status = 429
+    else:
+        message = "The assistant is busy right now. Please try again in a few seconds."
+        status = 503
+    response = JsonResponse({'error': rejection.reason, 'bot_response': message}, status=status)
+    if rejection.retry_after is not None:
+        response['Retry-After'] = str(max(1, round(rejection.retry_after)))
+    return response
+
+
 @login_required
 def start_chat(request, document_id):
     try:
@@ -309,10 +551,13 @@ def start_chat(request, document_id):
             defaults={'status': 'active'}
         )
         
+        summary = DocumentSummary.objects.filter(document=document, status="completed").first()
+        
         return JsonResponse({
             'success': True,
             'session_id': str(chat_session.id),
-            'document_name': document.file.name
+            'document_name': document.file.name,
+            'suggested_questions': summary.suggested_questions if summary else []
         })
     except Exception as e:
         return JsonResponse({
@@ -324,7 +569,7 @@ def start_chat(request, document_id):
 def chat_with_document(request, session_id):
     if request.method == 'POST':
         try:
-            session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+            session = get_object_or_404(ChatSession.objects.select_related('document'), id=session_id, user=request.user)
             data = json.loads(request.body)
             message = data.get('message')
             
@@ -332,7 +577,14 @@ def chat_with_document(request, session_id):
             document = session.document
             
             # Process message using RAG and pass the session
-            response = process_user_question(message, document.collection_name, session)
+            try:
+                response = process_user_question(
+                    message, document.collection_name, session,
+                    user_id=request.user.id, embedding_model_name=document.embedding_model_name,
+                    document_id=document.id,
+                )
+            except AdmissionRejected as e:
+                return busy_response(e)
             
             # Save the chat message
             ChatMessage.objects.create(
@@ -359,10 +611,17 @@ def chat_with_document(request, session_id):
         data = json.loads(request.body)
         message = data.get('message')
         
-        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        session = get_object_or_404(ChatSession.objects.select_related('document'), id=session_id, user=request.user)
         
         # Process the message using your RAG system
-        response = process_user_question(message, session.document.collection_name)
+        try:
+            response = process_user_question(
+                message, session.document.collection_name,
+                user_id=request.user.id, embedding_model_name=session.document.embedding_model_name,
+                document_id=session.document_id,
+            )
+        except AdmissionRejected as e:
+            return busy_response(e)
         
         # Save the chat message
         ChatMessage.objects.create(
@@ -378,7 +637,7 @@ def chat_with_document(request, session_id):
 
 @login_required
 def chat_interface(request, session_id):
-    chat_session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+    chat_session = get_object_or_404(ChatSession.objects.select_related('document'), id=session_id, user=request.user)
     document = chat_session.document
     
     # Get chat history
@@ -421,6 +680,38 @@ def chat_history(request, session_id):
 
 
 
+@login_required
+def search_chat_history(request):
+    """Full-text search across all of the user's chat sessions, ranked and highlighted, one page at a time."""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'Missing search query'}, status=400)
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page number'}, status=400)
+
+    results, has_next = search_messages(request.user, query, page)
+    return JsonResponse({'results': results, 'page': page, 'has_next': has_next})
+
+
+@staff_member_required
+def metrics_view(request):
+    """In-process metrics of this worker (latencies, score distributions, counters)."""
+    return JsonResponse(metrics.snapshot())
+
+
+@staff_member_required
+def usage_view(request):
+    """Per-user resource usage over the last ?days=N days (default 30) and current vector storage."""
+    try:
+        days = max(1, int(request.GET.get('days', 30)))
+    except ValueError:
+        return JsonResponse({'error': 'days must be an integer'}, status=400)
+    flush_usage()  # Include this worker's buffered usage
+    return JsonResponse({'days': days, 'users': usage_report(days)})
+
+
 # from django.shortcuts import render
 from django.utils.timezone import now
 
@@ -108,6 +108,75 @@ document.addEventListener("DOMContentLoaded", function() {
         }
     });
 
+    // Files above this size use the resumable chunked upload API
+    const CHUNKED_UPLOAD_THRESHOLD = 5 * 1024 * 1024;
+
+    // Uploads a file in chunks, resuming an interrupted upload of the same file.
+    // Resolves with the same JSON shape as the single-request upload.
+    async function chunkedUpload(file) {
+        const headers = {
+            'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value,
+            'X-Requested-With': 'XMLHttpRequest'
+        };
+        const resumeKey = `chunkedUpload:${file.name}:${file.size}:${file.lastModified}`;
+        let upload = null;
+
+        const savedUploadId = localStorage.getItem(resumeKey);
+        if (savedUploadId) {
+            const response = await fetch(`/upload/chunked/${savedUploadId}/`, { headers: headers });
+            if (response.ok) {
+                upload = await response.json();
+            }
+        }
+        if (!upload) {
+            const response = await fetch('/upload/chunked/', {
+                method: 'POST',
+                headers: { ...headers, 'Content-Type': 'application/json' },
+                body: JSON.stringify({ filename: file.name, size: file.size })
+            });
+            upload = await response.json();
+            if (!upload.success) {
+                throw new Error(upload.error);
+            }
+            localStorage.setItem(resumeKey, upload.upload_id);
+        }
+
+        let retries = 0;
+        while (upload.status === 'uploading' && upload.offset < upload.size) {
+            try {
+                const response = await fetch(`/upload/chunked/${upload.upload_id}/`, {
+                    method: 'PUT',
+                    headers: { ...headers, 'X-Upload-Offset': upload.offset },
+                    body: file.slice(upload.offset, upload.offset + upload.chunk_size)
+                });
+                const data = await response.json();
+                if (data.offset === null || data.offset === undefined) {
+                    throw new Error(data.error);
+                }
+                // On a 409 the server tells us where to continue from
+                upload.offset = data.offset;
+                if (response.ok) {
+                    retries = 0;
+                    continue;
+                }
+                throw new Error(data.error);
+            } catch (error) {
+                if (++retries > 5) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            }
+        }
+
+        const response = await fetch(`/upload/chunked/${upload.upload_id}/finalize/`, {
+            method: 'POST',
+            headers: headers
+        });
+        const data = await response.json();
+        localStorage.removeItem(resumeKey);
+        return data;
+    }
+
     function handleFileUpload() {
         const file = fileUpload.files[0];
         if (file) {
@@ -121,14 +190,17 @@ document.addEventListener("DOMContentLoaded", function() {
             preloader.style.display = 'block';
             successMessage.style.display = 'none';
 
-            fetch(uploadForm.action, {
-                method: 'POST',
-                body: formData,
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            })
-            .then(response => response.json())
+            const uploadRequest = file.size > CHUNKED_UPLOAD_THRESHOLD
+                ? chunkedUpload(file)
+                : fetch(uploadForm.action, {
+                    method: 'POST',
+                    body: formData,
+                    headers: {
+                        'X-Requested-With': 'XMLHttpRequest'
+                    }
+                }).then(response => response.json());
+
+            uploadRequest
             .then(data => {
                 preloader.style.display = 'none';
                 if (data.success) {
@@ -540,19 +612,23 @@ document.addEventListener("DOMContentLoaded", function() {
             btn.innerHTML = '<i class="fa-spin fa-spinner fas"></i> Uploading...';
             btn.disabled = true;
 
+            const file = modalFileUpload.files[0];
             const formData = new FormData();
-            formData.append('file', modalFileUpload.files[0]);
+            formData.append('file', file);
             formData.append('csrfmiddlewaretoken', document.querySelector('[name=csrfmiddlewaretoken]').value);
 
-            fetch(modalUploadForm.action, {
-                method: 'POST',
-                body: formData,
-                headers: {
-                    'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value,
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            })
-            .then(response => response.json())
+            const uploadRequest = file.size > CHUNKED_UPLOAD_THRESHOLD
+                ? chunkedUpload(file)
+                : fetch(modalUploadForm.action, {
+                    method: 'POST',
+                    body: formData,
+                    headers: {
+                        'X-CSRFToken': document.querySelector('[name=csrfmiddlewaretoken]').value,
+                        'X-Requested-With': 'XMLHttpRequest'
+                    }
+                }).then(response => response.json());
+
+            uploadRequest
             .then(data => {
                 if (data.success) {
                     btn.innerHTML = '<i class="fa-check-circle fas"></i> Uploaded!';